@@ -1,9 +1,16 @@
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
 import math
+import os
 import random
 import subprocess
 import sys
 import time
 import traceback
+from typing import Any, Callable, Hashable, Iterable, Iterator
 
 try:
     import numpy as np
@@ -12,6 +19,9 @@ except ImportError:
 
     import numpy as np
 
+# keep stdout clean for the headless modes, which write their results there
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
 try:
     import pygame
 except ImportError:
@@ -19,6 +29,15 @@ except ImportError:
 
     import pygame
 
+from game_record import GameRecord, GameRecordWriter, GROW_NONE, GROW_RIGHT, GROW_LEFT, RESULT_DRAW, \
+    RESULT_UNFINISHED, encode_move, final_board, iter_positions, read_games, second_player
+from tablebase import get_tablebase
+from tuning import DEFAULT_WEIGHTS, read_weights
+from profiling import MoveProfiler, PROFILE_MODES, profiler_from_env
+from metrics import Metrics, start_file_dump, start_http_server
+from dispatch import CoalescingExecutor
+from large_board import SearchTimeout, SparseBoard, choose_move
+
 __EMPTY__ = 0
 __PLAYER_ONE__ = 1
 __PLAYER_TWO__ = 2
@@ -29,11 +48,21 @@ OPPONENT = 2
 TURN = 1
 BIG_NUMBER = 999999
 
+# boards with more rows or columns are played in large-board mode, see `large_board.py` and `is_large_board`
+LARGE_BOARD_SIZE = 9
+MAX_ROW_COUNT = 16
+# recorded moves keep the column in 6 bits
+MAX_COL_COUNT = 64
+# time budget of a computer move in large-board mode, in seconds
+LARGE_MOVE_TIME = float(os.environ.get('C4_LARGE_MOVE_TIME', '2'))
+
 CELL_SIZE = 80
 PIECE_RADIUS = int(CELL_SIZE / 2 - 4)
+MAX_SCREEN_WIDTH = 1600
 SCREEN_WIDTH = COL_COUNT * CELL_SIZE
 SCREEN_HEIGHT = (ROW_COUNT + 1) * CELL_SIZE
-SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+# the window is only created by `init`, so headless modes never open one
+SCREEN = None
 
 COLORS = {__EMPTY__: pygame.color.THECOLORS['white'],
           __PLAYER_ONE__: pygame.color.THECOLORS['red'],
@@ -44,6 +73,45 @@ BEST_COL = random.randrange(COL_COUNT)
 
 INIT_COL_COUNT = 7
 
+# games are appended to this record file, an empty C4_RECORD_PATH turns the recording off
+RECORD_PATH = os.environ.get('C4_RECORD_PATH', 'games.c4r') or None
+RECORDER = None
+
+# evaluation weights of `evaluate_interval` and `score_center`, replaced by `load_weights`
+WEIGHTS_PATH = os.environ.get('C4_WEIGHTS_PATH', 'weights.json')
+WEIGHTS = dict(DEFAULT_WEIGHTS)
+
+# search depth of each difficulty level (0 - easy, 1 - medium, 2 - hard)
+SEARCH_DEPTH = {0: 0, 1: 5, 2: 8}
+DIFFICULTY_NAMES = {0: 'easy', 1: 'medium', 2: 'hard'}
+PLAYER_NAMES = {__PLAYER_ONE__: 'player_one', __PLAYER_TWO__: 'player_two', __COMPUTER__: 'computer'}
+
+# `time.monotonic()` value at which the running search is abandoned with `SearchTimeout`, see `timed_search`
+SEARCH_DEADLINE = math.inf
+
+# search counters, incremented by the AI algorithms and read around each search by `measure_search`
+NODES = 0
+TABLEBASE_PROBES = 0
+TABLEBASE_HITS = 0
+
+METRICS = Metrics()
+METRICS.counter('c4_games_started_total', 'Games started')
+METRICS.counter('c4_games_finished_total', 'Games finished, by outcome')
+METRICS.histogram('c4_move_latency_seconds', 'Time taken by the AI to choose a move, without the display delays')
+METRICS.counter('c4_nodes_searched_total', 'Positions visited by the AI algorithms')
+METRICS.counter('c4_tablebase_probes_total', 'Endgame tablebase lookups')
+METRICS.counter('c4_tablebase_hits_total', 'Endgame tablebase lookups which found the position')
+METRICS.counter('c4_positions_analyzed_total', 'Positions analyzed by the headless analysis')
+METRICS.counter('c4_search_requests_total', 'Dispatched searches, by outcome: cache hit, coalesced or searched (miss)')
+
+# opt-in profiling of the AI moves, see `profiling.py`
+PROFILER = None
+
+# opt-in metrics exporters, see `metrics.py`
+METRICS_PORT = int(os.environ['C4_METRICS_PORT']) if os.environ.get('C4_METRICS_PORT') else None
+METRICS_FILE = os.environ.get('C4_METRICS_FILE') or None
+METRICS_INTERVAL = float(os.environ.get('C4_METRICS_INTERVAL', '15'))
+
 
 def log(msg: any, error_msg: bool = False, end_line: bool = True) -> None:
     """
@@ -62,6 +130,15 @@ def log(msg: any, error_msg: bool = False, end_line: bool = True) -> None:
               flush=True)
 
 
+def log_stderr(msg: any) -> None:
+    """
+    Logs a message on stderr, keeping stdout for the results of the headless modes.\n
+    :param msg: any arbitrary message to be logged
+    :return: none
+    """
+    print(f'[4InaRow]: {msg}', file=sys.stderr, flush=True)
+
+
 def init() -> None:
     """
     Initialization function for parsing and validating command line arguments.\n
@@ -75,6 +152,8 @@ def init() -> None:
     global SCREEN_WIDTH
     global SCREEN
     global INIT_COL_COUNT
+    global CELL_SIZE
+    global PIECE_RADIUS
 
     if len(sys.argv) < 5:
         log("Wrong number of arguments!")
@@ -93,13 +172,17 @@ def init() -> None:
         ROW_COUNT = int(sys.argv[2])
         COL_COUNT = int(sys.argv[3])
         INIT_COL_COUNT = COL_COUNT
+        if ROW_COUNT < 4 or ROW_COUNT > MAX_ROW_COUNT or COL_COUNT < 4 or COL_COUNT > MAX_COL_COUNT:
+            log(f"Rows must be between 4 and {MAX_ROW_COUNT} and columns between 4 and {MAX_COL_COUNT}")
+            exit(-1)
+
+        # shrink the cells of wide boards, so that the window fits even when the board has grown to its maximum
+        CELL_SIZE = max(20, min(CELL_SIZE, MAX_SCREEN_WIDTH // min(2 * COL_COUNT, MAX_COL_COUNT)))
+        PIECE_RADIUS = int(CELL_SIZE / 2 - 4)
         SCREEN_WIDTH = COL_COUNT * CELL_SIZE
         SCREEN_HEIGHT = (ROW_COUNT + 1) * CELL_SIZE
         SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Connect Four")
-        if ROW_COUNT < 4 or ROW_COUNT > 9 or COL_COUNT < 4 or COL_COUNT > 9:
-            log("Rows and columns numbers must be between 4 and 9")
-            exit(-1)
     except TypeError:
         log("Rows and columns numbers must be integers")
         log('', error_msg=True)
@@ -121,6 +204,143 @@ def init() -> None:
         exit(-1)
 
 
+def load_weights(path: str) -> None:
+    """
+    Loads the evaluation weights from a weights file (see `tuning.py`), if it exists.\n
+    :param path: path of the weights file
+    :return: none
+    """
+    global WEIGHTS
+
+    if not os.path.exists(path):
+        return
+
+    try:
+        WEIGHTS = read_weights(path)
+    except (OSError, ValueError):
+        log(f"Could not load the evaluation weights from {path}, using the default ones")
+        log('', error_msg=True)
+        return
+
+
+def init_worker(weights: dict[str, float], profiler: MoveProfiler | None) -> None:
+    """
+    Passes the settings of the main process on to a worker process.\n
+    :param weights: the evaluation weights
+    :param profiler: the move profiler or None
+    :return: none
+    """
+    global WEIGHTS, PROFILER
+    WEIGHTS = weights
+    PROFILER = profiler
+
+
+def move_profile(depth: int, ply: int, prefix: str = '') -> contextlib.AbstractContextManager:
+    """
+    Profiles an AI move if profiling is enabled.\n
+    :param depth: search depth of the move
+    :param ply: number of pieces on the board
+    :param prefix: prefix of the report file names
+    :return: a context manager wrapping the move
+    """
+    if PROFILER is None:
+        return contextlib.nullcontext()
+
+    return PROFILER.profile_move(ROW_COUNT, COL_COUNT, depth, ply, prefix)
+
+
+def count_nodes(nodes: int) -> None:
+    """
+    Adds the positions visited by a search which keeps its own counter to `NODES`.\n
+    :param nodes: number of positions visited
+    :return: None
+    """
+    global NODES
+    NODES += nodes
+
+
+@contextlib.contextmanager
+def measure_search() -> Iterator[dict[str, float]]:
+    """
+    Measures the duration and the search counters of the code run inside the `with` block.\n
+    The yielded dict is filled in when the block ends ('seconds', 'nodes', 'tablebase_probes', 'tablebase_hits').
+    It can be sent back from a worker process, to be recorded by the main process with `record_search`.\n
+    :return: a context manager yielding the measures
+    """
+    stats = {}
+    start_nodes, start_probes, start_hits = NODES, TABLEBASE_PROBES, TABLEBASE_HITS
+    start_time = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats['seconds'] = time.perf_counter() - start_time
+        stats['nodes'] = NODES - start_nodes
+        stats['tablebase_probes'] = TABLEBASE_PROBES - start_probes
+        stats['tablebase_hits'] = TABLEBASE_HITS - start_hits
+
+
+def record_search(stats: dict[str, float], **labels: str) -> None:
+    """
+    Records the latency and the search counters of a search in the metrics.\n
+    :param stats: measures of the search, see `measure_search`
+    :param labels: labels of the series
+    :return: None
+    """
+    METRICS.observe('c4_move_latency_seconds', stats['seconds'], **labels)
+    METRICS.inc('c4_nodes_searched_total', stats['nodes'], **labels)
+    METRICS.inc('c4_tablebase_probes_total', stats['tablebase_probes'], **labels)
+    METRICS.inc('c4_tablebase_hits_total', stats['tablebase_hits'], **labels)
+
+
+def record_worker_search(result: tuple) -> None:
+    """
+    Records the search of a worker process, whose result is (value, labels, measures of the search).\n
+    :param result: the result returned by the worker
+    :return: None
+    """
+    _, labels, stats = result
+    record_search(stats, **labels)
+
+
+def move_labels(difficulty: int) -> dict[str, str]:
+    """
+    Labels of the metrics of a computer move.\n
+    :param difficulty: chosen difficulty level
+    :return: the labels
+    """
+    return {'difficulty': DIFFICULTY_NAMES[difficulty], 'board': f'{ROW_COUNT}x{COL_COUNT}'}
+
+
+@contextlib.contextmanager
+def move_metrics(difficulty: int) -> Iterator[None]:
+    """
+    Records the latency and the search counters of a computer move.\n
+    :param difficulty: chosen difficulty level
+    :return: a context manager wrapping the move
+    """
+    labels = move_labels(difficulty)
+    stats = {}
+    try:
+        with measure_search() as stats:
+            yield
+    finally:
+        record_search(stats, **labels)
+
+
+def start_metrics_exporters(port: int | None, path: str | None, interval: float) -> None:
+    """
+    Exposes the metrics on a local HTTP endpoint and/or in a periodically rewritten file.\n
+    :param port: port of the `/metrics` HTTP endpoint or None
+    :param path: path of the metrics file or None
+    :param interval: seconds between two writes of the metrics file
+    :return: None
+    """
+    if port is not None:
+        start_http_server(METRICS, port)
+    if path is not None:
+        start_file_dump(METRICS, path, interval)
+
+
 def init_board(rows: int, cols: int) -> np.ndarray:
     """
     Initialize the game board as a 0-filled matrix\n
@@ -209,11 +429,28 @@ def grow_board(board: np.ndarray, direction: int) -> np.ndarray:
 
     COL_COUNT += 1
     SCREEN_WIDTH = COL_COUNT * CELL_SIZE
-    SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    if SCREEN is not None:
+        SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 
     return new_board
 
 
+def can_grow() -> bool:
+    """
+    Checks whether the board can still grow, i.e. whether playing in an edge column adds a new column.\n
+    :return: True if the board has not reached its maximum width
+    """
+    return COL_COUNT < min(2 * INIT_COL_COUNT, MAX_COL_COUNT)
+
+
+def is_large_board() -> bool:
+    """
+    Checks whether the board, at its current size, is played in large-board mode.\n
+    :return: True if the board has more than `LARGE_BOARD_SIZE` rows or columns
+    """
+    return ROW_COUNT > LARGE_BOARD_SIZE or COL_COUNT > LARGE_BOARD_SIZE
+
+
 def place_piece_onefunc(board: np.ndarray, col: int, player: int) -> bool | tuple[bool, np.ndarray]:
     """
     Utility function to place a piece in a specific column in a single line.
@@ -243,18 +480,62 @@ def place_piece_onefunc(board: np.ndarray, col: int, player: int) -> bool | tupl
 
     board[first_empty][col] = player
 
-    new_board = None
-    if COL_COUNT < 2 * INIT_COL_COUNT:
+    new_board = board
+    if can_grow():
         if col == 0:
             new_board = grow_board(board, 1)
         elif col == COL_COUNT - 1:
             new_board = grow_board(board, 0)
-        else:
-            new_board = board
 
     return True, new_board
 
 
+def record_move(col: int, prev_col_count: int) -> None:
+    """
+    Appends a placed piece to the current game record, if one is being written.\n
+    :param col: column in which the piece was placed
+    :param prev_col_count: number of columns before the piece was placed
+    :return: None
+    """
+    if RECORDER is None:
+        return
+
+    growth = GROW_NONE
+    if COL_COUNT > prev_col_count:
+        growth = GROW_LEFT if col == 0 else GROW_RIGHT
+
+    RECORDER.add_move(col, growth)
+
+
+def start_game(difficulty: int | None) -> None:
+    """
+    Starts the game record and counts the new game.\n
+    :param difficulty: the computer difficulty or None for a two player game
+    :return: None
+    """
+    METRICS.inc('c4_games_started_total',
+                opponent='computer' if OPPONENT == __COMPUTER__ else 'player',
+                difficulty=DIFFICULTY_NAMES.get(difficulty, 'none'))
+
+    if RECORDER is not None:
+        RECORDER.begin_game(ROW_COUNT, INIT_COL_COUNT, TURN, difficulty)
+
+
+def finish_game(winner: int, is_draw: bool = False) -> None:
+    """
+    Closes the current game record with its result and counts the outcome.\n
+    :param winner: the winner of the game
+    :param is_draw: flag for a draw game
+    :return: None
+    """
+    METRICS.inc('c4_games_finished_total',
+                opponent='computer' if OPPONENT == __COMPUTER__ else 'player',
+                outcome='draw' if is_draw else PLAYER_NAMES[winner])
+
+    if RECORDER is not None:
+        RECORDER.end_game(RESULT_DRAW if is_draw else winner)
+
+
 def is_draw(board: np.ndarray) -> bool:
     """
     Checks if the game board is in a draw state i.e. the board is filled\n
@@ -321,6 +602,34 @@ def is_win(board: np.ndarray, player: int) -> bool:
     return False
 
 
+def is_win_after_move(board: np.ndarray, col: int, prev_col_count: int, player: int) -> bool:
+    """
+    Checks if the piece just placed has won the game,
+    only looking at the lines of four going through it instead of the whole board.\n
+    :param board: the game board, after the move
+    :param col: the column in which the piece was placed
+    :param prev_col_count: number of columns before the piece was placed
+    :param player: the player who placed the piece
+    :return: True if the player has won, else False
+    """
+    # the pieces moved one column to the right if the board grew on the left
+    if COL_COUNT > prev_col_count and col == 0:
+        col += 1
+    row = int(np.flatnonzero(board[:, col])[0])
+
+    for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        count = 1
+        for sign in (1, -1):
+            it_row, it_col = row + sign * d_row, col + sign * d_col
+            while 0 <= it_row < ROW_COUNT and 0 <= it_col < COL_COUNT and board[it_row][it_col] == player:
+                count += 1
+                it_row, it_col = it_row + sign * d_row, it_col + sign * d_col
+        if count >= 4:
+            return True
+
+    return False
+
+
 def draw_board(board: np.ndarray) -> None:
     """
     Draws the game board on the screen.\n
@@ -493,16 +802,16 @@ def evaluate_interval(interval: list[int], player: int) -> int:
     if interval.count(player) == 4:
         score += BIG_NUMBER
     elif interval.count(player) == 3 and interval.count(__EMPTY__) == 1:
-        score += 5
+        score += WEIGHTS['three']
     elif interval.count(player) == 2 and interval.count(__EMPTY__) == 2:
-        score += 2
+        score += WEIGHTS['two']
 
     if interval.count(opponent) == 4:
         score -= BIG_NUMBER
     elif interval.count(opponent) == 3 and interval.count(__EMPTY__) == 1:
-        score -= 10
+        score += WEIGHTS['opponent_three']
     elif interval.count(opponent) == 2 and interval.count(__EMPTY__) == 2:
-        score -= 2
+        score += WEIGHTS['opponent_two']
 
     return score
 
@@ -552,7 +861,7 @@ def score_center(board: np.ndarray, player: int) -> int:
     """
     center_col = list(np.transpose(board)[COL_COUNT // 2])
     center_count = center_col.count(player)
-    score = center_count * 3
+    score = center_count * WEIGHTS['center']
 
     return score
 
@@ -616,7 +925,11 @@ def minimax_alphabeta(board: np.ndarray, depth: int, alpha: float, beta: float,
     :param player: current player
     :return: the score of the best next move found
     """
-    global BEST_COL
+    global BEST_COL, NODES
+    NODES += 1
+    if time.monotonic() > SEARCH_DEADLINE:
+        raise SearchTimeout()
+
     opponent = __PLAYER_ONE__ if player == __COMPUTER__ else __COMPUTER__
     if is_end_state(board):
         if is_draw(board):
@@ -631,6 +944,7 @@ def minimax_alphabeta(board: np.ndarray, depth: int, alpha: float, beta: float,
     valid_cols = get_valid_cols(board)
     if maximizing_player:
         score = -math.inf
+        best_col = None
         for col in valid_cols:
             row = find_first_empty(board, col)
             place_piece(board, row, col, player)
@@ -641,21 +955,23 @@ def minimax_alphabeta(board: np.ndarray, depth: int, alpha: float, beta: float,
                 score = new_score
                 alpha = max(alpha, score)
 
-                BEST_COL = col
+                best_col = col
 
                 if alpha >= beta:
                     break
 
+        # set last, so that the root call overrides the moves found deeper in the tree
+        BEST_COL = best_col
         return score
     else:
         score = math.inf
         for col in valid_cols:
             row = find_first_empty(board, col)
             place_piece(board, row, col, opponent)
-            score = minimax_alphabeta(board, depth - 1, alpha, beta, True, player)
+            new_score = minimax_alphabeta(board, depth - 1, alpha, beta, True, player)
             revert_move(board, row, col)
-            # if new_score < score:
-            #     score = new_score
+            if new_score < score:
+                score = new_score
 
             beta = min(beta, score)
             if alpha >= beta:
@@ -664,55 +980,149 @@ def minimax_alphabeta(board: np.ndarray, depth: int, alpha: float, beta: float,
         return score
 
 
-def negamax(board: np.ndarray, depth: int, player: int, alpha: float, beta: float, maximizing: int):
+def negamax(board: np.ndarray, depth: int, player: int, alpha: float, beta: float):
     """
     Implementation of the negamax algorithm with specified depth and alpha-beta pruning.\n
-    The algorithm sets the global variable `BEST_COL` to the best next move found and returns the score of that move.\n
+    The algorithm sets the global variable `BEST_COL` to the best next move found and returns the score of that move,
+    from the point of view of the player to move.\n
     :param board: game board
     :param depth: maximum depth for the search tree
-    :param player: current player
+    :param player: player to move
     :param alpha: minimum score to find
     :param beta: maximum score to find
-    :param maximizing: 1 if trying to maximize, -1 for minimizing (negating score)
     :return: the score of the best next move found
     """
 
-    global BEST_COL
+    global BEST_COL, NODES
+    NODES += 1
+    if time.monotonic() > SEARCH_DEADLINE:
+        raise SearchTimeout()
 
-    # order in which to check the next possible moves in the AI algorithms
-    column_order = [math.floor(COL_COUNT / 2 + (1 - 2 * (i % 2)) * (i + 1) / 2) for i in range(COL_COUNT - 1)]
     opponent = __PLAYER_ONE__ if player == __COMPUTER__ else __COMPUTER__
 
     if is_draw(board):
         return 0
 
     if depth == 0:
-        return maximizing * score_state(board, player)
+        return score_state(board, player)
 
     valid_cols = get_valid_cols(board)
 
-    # check if there is any direct next move to win the game
+    # check if there is any direct next move to win the game, only looking at the lines through the new piece
     for col in valid_cols:
         row = find_first_empty(board, col)
         place_piece(board, row, col, player)
-        if is_win(board, player):
+        if is_win_after_move(board, col, COL_COUNT, player):
             revert_move(board, row, col)
             BEST_COL = col
-            return maximizing * BIG_NUMBER
+            return BIG_NUMBER
         revert_move(board, row, col)
 
-    best_score = -math.inf
-    for col in column_order:
+    best_col, best_score = None, -math.inf
+    for col in center_order(COL_COUNT):
         if col not in valid_cols:
             continue
         row = find_first_empty(board, col)
-        place_piece(board, row, col, opponent)
-        score = -negamax(board, depth - 1, opponent, -beta, -alpha, -maximizing)
+        place_piece(board, row, col, player)
+        score = -negamax(board, depth - 1, opponent, -beta, -alpha)
         revert_move(board, row, col)
 
         if score > best_score:
-            best_score = score
-            BEST_COL = col
+            best_col, best_score = col, score
+        alpha = max(alpha, best_score)
+        if alpha >= beta:
+            break
+
+    # set last, so that the root call overrides the moves found deeper in the tree
+    BEST_COL = best_col
+    return best_score
+
+
+def tablebase_move(board: np.ndarray, player: int) -> tuple[int, int] | None:
+    """
+    Looks up a perfect move in the endgame tablebase of the current board size, if there is one.\n
+    Like the solver, the tablebases assume that the board keeps its width (see `can_grow`).
+    They are only used by the solver: the game boards which can no longer grow are too large for a tablebase.\n
+    :param board: game board
+    :param player: player to move
+    :return: the best column and its exact score (see `solve`), or None if the position is not covered
+    """
+    global TABLEBASE_PROBES, TABLEBASE_HITS
+
+    table = get_tablebase(ROW_COUNT, COL_COUNT)
+    if table is None or not table.covers(board):
+        return None
+
+    TABLEBASE_PROBES += 1
+    found = table.best_move(board, player)
+    if found is not None:
+        TABLEBASE_HITS += 1
+    return found
+
+
+def center_order(cols: int) -> list[int]:
+    """
+    Orders the columns from the center outwards, the order in which moves are tried by the solver.\n
+    :param cols: number of columns
+    :return: list of column indices
+    """
+    return sorted(range(cols), key=lambda col: abs(col - (cols - 1) / 2))
+
+
+def solve(board: np.ndarray, player: int, alpha: float, beta: float) -> int:
+    """
+    Exact negamax search with alpha-beta pruning, without any depth limit.\n
+    The score is positive if the player to move wins, negative if they lose and 0 for a draw.
+    A win is scored with the number of empty cells left before the winning move, so faster wins score higher.\n
+    Only practical on small boards or positions with few empty cells.\n
+    :param board: game board
+    :param player: player to move
+    :param alpha: minimum score to find
+    :param beta: maximum score to find
+    :return: the exact score of the position
+    """
+    global NODES, TABLEBASE_PROBES, TABLEBASE_HITS
+    NODES += 1
+    if time.monotonic() > SEARCH_DEADLINE:
+        raise SearchTimeout()
+
+    opponent = __PLAYER_ONE__ if player == __COMPUTER__ else __COMPUTER__
+    valid_cols = [col for col in center_order(COL_COUNT) if not is_full_col(board, col)]
+    if not valid_cols:
+        return 0
+
+    empty_count = int(np.count_nonzero(board == __EMPTY__))
+
+    table = get_tablebase(ROW_COUNT, COL_COUNT)
+    if table is not None and empty_count <= table.max_empty:
+        TABLEBASE_PROBES += 1
+        score = table.lookup(board, player)
+        if score is not None:
+            TABLEBASE_HITS += 1
+            return score
+
+    # check if there is any direct next move to win the game
+    for col in valid_cols:
+        row = find_first_empty(board, col)
+        place_piece(board, row, col, player)
+        if is_win_after_move(board, col, COL_COUNT, player):
+            revert_move(board, row, col)
+            return empty_count
+        revert_move(board, row, col)
+
+    # without a direct win, the best possible outcome is winning with the next own move, or a draw
+    beta = min(beta, max(empty_count - 2, 0))
+    if alpha >= beta:
+        return beta
+
+    best_score = -math.inf
+    for col in valid_cols:
+        row = find_first_empty(board, col)
+        place_piece(board, row, col, player)
+        score = -solve(board, opponent, -beta, -alpha)
+        revert_move(board, row, col)
+
+        best_score = max(best_score, score)
         alpha = max(alpha, best_score)
         if alpha >= beta:
             break
@@ -720,6 +1130,38 @@ def negamax(board: np.ndarray, depth: int, player: int, alpha: float, beta: floa
     return best_score
 
 
+def solve_root(board: np.ndarray, player: int) -> tuple[int, int]:
+    """
+    Finds the best move of a position with the exact solver.\n
+    :param board: game board
+    :param player: player to move
+    :return: the best column and its exact score (see `solve`)
+    """
+    found = tablebase_move(board, player)
+    if found is not None:
+        return found
+
+    opponent = __PLAYER_ONE__ if player == __COMPUTER__ else __COMPUTER__
+    empty_count = int(np.count_nonzero(board == __EMPTY__))
+
+    best_col, best_score = None, -math.inf
+    for col in center_order(COL_COUNT):
+        if is_full_col(board, col):
+            continue
+        row = find_first_empty(board, col)
+        place_piece(board, row, col, player)
+        if is_win_after_move(board, col, COL_COUNT, player):
+            score = empty_count
+        else:
+            score = -solve(board, opponent, -math.inf, -best_score)
+        revert_move(board, row, col)
+
+        if score > best_score:
+            best_col, best_score = col, score
+
+    return best_col, best_score
+
+
 def get_computer_move(board: np.ndarray, difficulty: int) -> int:
     """
     Get the next move for the computer player based on the difficulty level.\n
@@ -727,21 +1169,42 @@ def get_computer_move(board: np.ndarray, difficulty: int) -> int:
     :param difficulty: chosen difficulty level
     :return: column number for the move
     """
-    global BEST_COL
     if difficulty == 0:
         pygame.time.wait(500)
-        return random.randrange(COL_COUNT)
-    if difficulty == 1:
-        BEST_COL = random.randrange(COL_COUNT)
-        # score = minimax_alphabeta(board, 3, -math.inf, math.inf, True, __COMPUTER__)
-        score = minimax_alphabeta(board, 5, -math.inf, math.inf, True, __COMPUTER__)
+    with move_metrics(difficulty):
+        col, score = search_move(board, difficulty)
+    if score is not None:
         log(score)
-        return BEST_COL
-    if difficulty == 2:
+
+    return col
+
+
+def search_move(board: np.ndarray, difficulty: int) -> tuple[int, float | None]:
+    """
+    Chooses the move of the computer player, without the display delay and the logging of `get_computer_move`,
+    so that it can also be used by worker processes.\n
+    :param board: game board
+    :param difficulty: chosen difficulty level
+    :return: column number for the move and its score (None for a random move)
+    """
+    global BEST_COL
+    if difficulty == 0:
+        return random.randrange(COL_COUNT), None
+
+    with move_profile(SEARCH_DEPTH[difficulty], int(np.count_nonzero(board))):
+        if is_large_board():
+            col, score, _, nodes = choose_move(SparseBoard.from_array(board), __COMPUTER__, __PLAYER_ONE__,
+                                               SEARCH_DEPTH[difficulty], LARGE_MOVE_TIME, WEIGHTS)
+            count_nodes(nodes)
+            return col, score
+        if difficulty == 1:
+            BEST_COL = random.randrange(COL_COUNT)
+            score = minimax_alphabeta(board, SEARCH_DEPTH[difficulty], -math.inf, math.inf, True, __COMPUTER__)
+            return BEST_COL, score
+
         BEST_COL = random.randrange(COL_COUNT)
-        score = negamax(board, 8, __COMPUTER__, -math.inf, math.inf, 1)
-        log(score)
-        return BEST_COL
+        score = negamax(board, SEARCH_DEPTH[difficulty], __COMPUTER__, -math.inf, math.inf)
+        return BEST_COL, score
 
 
 def game_loop(board: np.ndarray) -> None:
@@ -766,7 +1229,10 @@ def game_loop(board: np.ndarray) -> None:
     draw_board(board)
 
     # if the computer makes the first move, do it before the start of the loop
+    start_game(diff)
+
     if OPPONENT == __COMPUTER__ and TURN == __COMPUTER__:
+        prev_col_count = COL_COUNT
         computed_column = get_computer_move(board, diff)
         is_placed, new_board = place_piece_onefunc(board, computed_column, OPPONENT)
         board = new_board
@@ -774,8 +1240,8 @@ def game_loop(board: np.ndarray) -> None:
             computed_column = get_computer_move(board, diff)
             is_placed, new_board = place_piece_onefunc(board, computed_column, OPPONENT)
             board = new_board
+        record_move(computed_column, prev_col_count)
         pygame.time.wait(500)
-        print(board)
         draw_board(board)
         TURN = __PLAYER_ONE__
 
@@ -801,20 +1267,22 @@ def game_loop(board: np.ndarray) -> None:
 
                 draw_header(x_pos, COLORS[OPPONENT])
 
+                prev_col_count = COL_COUNT
                 is_placed, new_board = place_piece_onefunc(board, column, TURN)
                 board = new_board
                 if not is_placed:
                     continue
                 else:
-                    print(board)
+                    record_move(column, prev_col_count)
                     draw_board(board)
 
-                if is_win(board, TURN) or is_draw(board):
-                    print(board)
+                if is_win_after_move(board, column, prev_col_count, TURN) or is_draw(board):
                     draw_board(board)
+                    finish_game(TURN, is_draw(board))
                     display_end_screen(TURN, is_draw(board))
 
                 if OPPONENT == __COMPUTER__:
+                    prev_col_count = COL_COUNT
                     computed_column = get_computer_move(board, diff)
                     is_placed, new_board = place_piece_onefunc(board, computed_column, OPPONENT)
                     board = new_board
@@ -822,20 +1290,484 @@ def game_loop(board: np.ndarray) -> None:
                         computed_column = get_computer_move(board, diff)
                         is_placed, new_board = place_piece_onefunc(board, computed_column, OPPONENT)
                         board = new_board
-                    print(board)
+                    record_move(computed_column, prev_col_count)
                     draw_board(board)
 
-                    if is_win(board, OPPONENT) or is_draw(board):
-                        print(board)
+                    if is_win_after_move(board, computed_column, prev_col_count, OPPONENT) or is_draw(board):
                         draw_board(board)
+                        finish_game(OPPONENT, is_draw(board))
                         display_end_screen(OPPONENT, is_draw(board))
                 else:
                     TURN = __PLAYER_ONE__ if TURN == OPPONENT else OPPONENT
 
 
+def search_computer_move(task: tuple) -> tuple[int, dict[str, str], dict[str, float]]:
+    """
+    Process pool worker choosing a computer move, see `dispatch_computer_move`.\n
+    :param task: (rows, columns, int8 board bytes, difficulty)
+    :return: (column number for the move, metrics labels, measures of the search)
+    """
+    global ROW_COUNT, COL_COUNT
+
+    ROW_COUNT, COL_COUNT, board_bytes, difficulty = task
+    board = np.frombuffer(board_bytes, dtype=np.int8).reshape(ROW_COUNT, COL_COUNT).astype(float)
+
+    with measure_search() as stats:
+        col, _ = search_move(board, difficulty)
+
+    return col, move_labels(difficulty), stats
+
+
+def create_search_dispatcher(workers: int | None = None, max_entries: int = 4096,
+                             ttl: float | None = 600) -> CoalescingExecutor:
+    """
+    Creates the search-dispatch layer used to serve computer moves of many games at once:
+    a process pool in which concurrent requests for the same position, board size and difficulty share one search,
+    and recent results are cached. The searches are recorded in the metrics of this process.\n
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param max_entries: maximum number of cached moves
+    :param ttl: seconds a cached move stays valid, None to keep moves until evicted
+    :return: the dispatcher, to be passed to `dispatch_computer_move` and shut down when done
+    """
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                      initializer=init_worker,
+                                                      initargs=(WEIGHTS, PROFILER))
+    return CoalescingExecutor(executor, max_entries, ttl, count_search_request, record_worker_search)
+
+
+def dispatch_computer_move(dispatcher: CoalescingExecutor, board: np.ndarray,
+                           difficulty: int) -> concurrent.futures.Future:
+    """
+    Requests the computer move of a game through the search-dispatch layer.\n
+    Random (easy) moves are never shared between games.\n
+    :param dispatcher: dispatcher created by `create_search_dispatcher`
+    :param board: game board
+    :param difficulty: chosen difficulty level
+    :return: a future of the column number for the move
+    """
+    board = board.astype(np.int8)
+    task = (*board.shape, board.tobytes(), difficulty)
+    if difficulty == 0:
+        future = dispatcher.executor.submit(search_computer_move, task)
+        future.add_done_callback(lambda done: done.exception() is None and record_worker_search(done.result()))
+    else:
+        future = dispatcher.submit(task, search_computer_move, task)
+
+    return map_future(future, lambda result: result[0])
+
+
+def map_future(future: concurrent.futures.Future, func: Callable) -> concurrent.futures.Future:
+    """
+    Derives a future from another one, whose result is `func(result of the other future)`.\n
+    :param future: the source future
+    :param func: function applied to the result
+    :return: the derived future
+    """
+    mapped = concurrent.futures.Future()
+
+    def copy_result(done: concurrent.futures.Future) -> None:
+        if done.cancelled():
+            mapped.cancel()
+        elif done.exception() is not None:
+            mapped.set_exception(done.exception())
+        else:
+            mapped.set_result(func(done.result()))
+
+    future.add_done_callback(copy_result)
+    return mapped
+
+
+ENGINES = ('negamax', 'minimax_alphabeta', 'solver', 'large')
+
+
+def engine_search(board: np.ndarray, engine: str, depth: int, player: int = __COMPUTER__) -> tuple[int, float]:
+    """
+    Runs one of the AI algorithms on a position, the same way `get_computer_move` does.\n
+    :param board: game board, modified during the search and restored afterwards
+    :param engine: one of `ENGINES`
+    :param depth: maximum depth for the search tree, ignored by the solver
+    :param player: player to move
+    :return: the best column found and its score
+    """
+    global BEST_COL
+
+    if engine == 'solver':
+        return solve_root(board, player)
+    if engine == 'large':
+        # the sparse search keeps its own clock, it returns the last depth it completed before `SEARCH_DEADLINE`
+        time_limit = None if SEARCH_DEADLINE == math.inf else max(SEARCH_DEADLINE - time.monotonic(), 0)
+        col, score, _ = timed_search(board, engine, depth, time_limit, player)
+        if score is None:
+            raise SearchTimeout()
+        return col, score
+
+    BEST_COL = get_valid_cols(board)[0]
+    if engine == 'negamax':
+        score = negamax(board, depth, player, -math.inf, math.inf)
+    elif engine == 'minimax_alphabeta':
+        score = minimax_alphabeta(board, depth, -math.inf, math.inf, True, player)
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    return BEST_COL, score
+
+
+def timed_search(board: np.ndarray, engine: str, depth: int, time_limit: float | None,
+                 player: int = __COMPUTER__) -> tuple[int, float, int]:
+    """
+    Searches a position up to a fixed depth or, with a time limit, with iterative deepening.\n
+    With a time limit, deeper searches are started while there is time left and the search that is running
+    when the limit expires is abandoned, so the result is the one of the last complete depth.
+    The first depth always completes; the solver, which searches to the end of the game in one go,
+    finds no move if it does not finish in time.\n
+    :param board: game board
+    :param engine: one of `ENGINES`
+    :param depth: maximum depth for the search tree, ignored by the solver
+    :param time_limit: time budget in seconds or None to search straight to `depth`
+    :param player: player to move
+    :return: the best column found (None if the search did not finish), its score and the depth reached
+    """
+    empty_count = int(np.count_nonzero(board == __EMPTY__))
+    if engine == 'large':
+        opponent = __PLAYER_ONE__ if player == __COMPUTER__ else __COMPUTER__
+        col, score, reached, nodes = choose_move(SparseBoard.from_array(board), player, opponent,
+                                                 min(depth, empty_count),
+                                                 math.inf if time_limit is None else time_limit, WEIGHTS)
+        count_nodes(nodes)
+        return col, score, reached
+
+    if engine == 'solver':
+        depth = empty_count
+
+    if time_limit is None:
+        return *engine_search(board, engine, depth, player), depth
+
+    deadline = time.monotonic() + time_limit
+    if engine == 'solver':
+        found = deadline_search(board, engine, depth, deadline, player)
+        return (*found, depth) if found is not None else (None, None, 0)
+
+    col, score, reached = None, None, 0
+    for current_depth in range(1, min(depth, empty_count) + 1):
+        found = deadline_search(board, engine, current_depth, deadline if current_depth > 1 else math.inf, player)
+        if found is None:
+            break
+        (col, score), reached = found, current_depth
+
+    return col, score, reached
+
+
+def deadline_search(board: np.ndarray, engine: str, depth: int, deadline: float,
+                    player: int = __COMPUTER__) -> tuple[int, float] | None:
+    """
+    Runs `engine_search` on a copy of the board, abandoning it at a deadline.\n
+    :param board: game board, left untouched
+    :param engine: one of `ENGINES`
+    :param depth: maximum depth for the search tree, ignored by the solver
+    :param deadline: `time.monotonic()` value at which the search is abandoned, `math.inf` for none
+    :param player: player to move
+    :return: the best column found and its score, or None if the deadline expired first
+    """
+    global SEARCH_DEADLINE
+
+    SEARCH_DEADLINE = deadline
+    try:
+        # an abandoned search leaves its pieces on the board it was given
+        return engine_search(board.copy(), engine, depth, player)
+    except SearchTimeout:
+        return None
+    finally:
+        SEARCH_DEADLINE = math.inf
+
+
+def analyze_position(task: tuple) -> tuple[tuple, dict[str, str], dict[str, float]]:
+    """
+    Process pool worker analyzing a single position.\n
+    The player to move is mapped to `__COMPUTER__` and the other one to `__PLAYER_ONE__`,
+    which are the two sides the AI algorithms know about.\n
+    :param task: (rows, columns, int8 board bytes, player to move, column played or None, engine, depth, time limit)
+    :return: (analysis, metrics labels, measures of the search), see `analyze_board` for the analysis
+    """
+    global ROW_COUNT, COL_COUNT
+
+    ROW_COUNT, COL_COUNT, board_bytes, player, played_col, engine, depth, time_limit = task
+    board = np.frombuffer(board_bytes, dtype=np.int8).reshape(ROW_COUNT, COL_COUNT)
+    board = np.where(board == player, __COMPUTER__, np.where(board == __EMPTY__, __EMPTY__, __PLAYER_ONE__))
+
+    position_hash = hashlib.blake2b(board_bytes, digest_size=4).hexdigest()
+    with measure_search() as stats:
+        analysis = analyze_board(board, played_col, engine, depth, time_limit, f'position-{position_hash}')
+
+    return analysis, {'engine': engine, 'board': f'{ROW_COUNT}x{COL_COUNT}'}, stats
+
+
+def analyze_board(board: np.ndarray, played_col: int | None, engine: str, depth: int, time_limit: float | None,
+                  profile_prefix: str) -> tuple:
+    """
+    Analyzes a position whose player to move is `__COMPUTER__`.\n
+    The time budget covers both searches: when a played move may have to be scored, the best move search gets
+    half of it and the played move search the rest, its score being unknown (None) if it does not finish in time.\n
+    :param board: game board
+    :param played_col: column played in the position or None
+    :param engine: one of `ENGINES`
+    :param depth: maximum depth for the search tree
+    :param time_limit: time budget in seconds or None
+    :param profile_prefix: prefix of the profiling report file names
+    :return: (best column, score, depth reached, column played, score of the played move)
+    """
+    if not get_valid_cols(board) or is_end_state(board):
+        return None, None, 0, played_col, None
+
+    deadline = math.inf if time_limit is None else time.monotonic() + time_limit
+    if time_limit is not None and played_col is not None:
+        time_limit /= 2
+
+    with move_profile(depth, int(np.count_nonzero(board)), profile_prefix):
+        best_col, score, reached = timed_search(board, engine, depth, time_limit)
+    if best_col is None:
+        return None, None, reached, played_col, None
+
+    played_score = None
+    if played_col is not None and played_col != best_col and not is_full_col(board, played_col):
+        row = find_first_empty(board, played_col)
+        place_piece(board, row, played_col, __COMPUTER__)
+        if is_win(board, __COMPUTER__):
+            played_score = BIG_NUMBER if engine != 'solver' else int(np.count_nonzero(board == __EMPTY__)) + 1
+        elif not get_valid_cols(board):
+            played_score = 0
+        else:
+            found = deadline_search(board, engine, max(reached - 1, 1), deadline, __PLAYER_ONE__)
+            played_score = None if found is None else -found[1]
+    elif played_col is not None and played_col == best_col:
+        played_score = score
+
+    return best_col, score, reached, played_col, played_score
+
+
+def parse_move_line(line: str, rows: int, cols: int, first_player: int) -> GameRecord:
+    """
+    Converts a text move sequence (comma or whitespace separated columns) into a game record,
+    growing the board with the same rule as `place_piece_onefunc`.\n
+    Raises a ValueError if a move is not a column number, is out of the board or is made in a full column.\n
+    :param line: the move sequence
+    :param rows: number of rows of the board
+    :param cols: initial number of columns of the board
+    :param first_player: the player making the first move
+    :return: the game record
+    """
+    moves = bytearray()
+    heights = [0] * cols
+    for token in line.replace(',', ' ').split():
+        try:
+            col = int(token)
+        except ValueError:
+            raise ValueError(f"Not a column number: {token!r}") from None
+        if not 0 <= col < len(heights):
+            raise ValueError(f"Column out of range: {col}")
+        if heights[col] >= rows:
+            raise ValueError(f"Column is already full: {col}")
+        heights[col] += 1
+
+        growth = GROW_NONE
+        if len(heights) < min(2 * cols, MAX_COL_COUNT) and (col == 0 or col == len(heights) - 1):
+            growth = GROW_LEFT if col == 0 else GROW_RIGHT
+            heights.insert(0 if col == 0 else len(heights), 0)
+        moves.append(encode_move(col, growth))
+
+    return GameRecord(rows, cols, first_player, None, bytes(moves), RESULT_UNFINISHED)
+
+
+def read_analysis_input(args: argparse.Namespace) -> Iterator[GameRecord]:
+    """
+    Streams the games to analyze from a file or stdin, in either input format.\n
+    Invalid move sequences are reported on stderr and skipped, a corrupted record file is read up to the corruption.\n
+    :param args: parsed command line arguments
+    :return: a generator of game records
+    """
+    if args.format == 'records':
+        source = sys.stdin.buffer if args.input == '-' else args.input
+        try:
+            yield from read_games(source)
+        except ValueError as error:
+            log_stderr(f"Stopping at a corrupted game record: {error}")
+        return
+
+    first_player = {'player1': __PLAYER_ONE__, 'player2': __PLAYER_TWO__}[args.first]
+    stream = sys.stdin if args.input == '-' else open(args.input)
+    with stream:
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            try:
+                record = parse_move_line(line, args.rows, args.cols, first_player)
+            except ValueError as error:
+                log_stderr(f"Skipping line {line_number}: {error}")
+                continue
+            yield record
+
+
+def iter_analysis_tasks(records: Iterable[GameRecord], args: argparse.Namespace) -> Iterator[tuple[tuple, tuple]]:
+    """
+    Turns a stream of games into a stream of `analyze_position` tasks.\n
+    Tasks only describe the search, so identical positions make identical (hashable) tasks.
+    Games with an invalid header are skipped and the replay of a game stops at its first invalid move,
+    both being reported on stderr.\n
+    :param records: the games to analyze
+    :param args: parsed command line arguments
+    :return: a generator of ((game index, ply), task)
+    """
+    for game_index, record in enumerate(records):
+        if not (4 <= record.rows <= MAX_ROW_COUNT and 4 <= record.cols <= MAX_COL_COUNT) \
+                or record.first_player not in PLAYER_NAMES:
+            log_stderr(f"Skipping game {game_index}: invalid header "
+                       f"({record.rows} rows, {record.cols} columns, first player {record.first_player})")
+            continue
+
+        try:
+            if args.final_only:
+                board = final_board(record)
+                player = record.first_player if len(record.moves) % 2 == 0 \
+                    else second_player(record.first_player, record.difficulty)
+                yield (game_index, len(record.moves)), \
+                    (*board.shape, board.astype(np.int8).tobytes(), player, None, args.engine, args.depth, args.time)
+                continue
+
+            for ply, (board, player, col) in enumerate(iter_positions(record)):
+                yield (game_index, ply), \
+                    (*board.shape, board.astype(np.int8).tobytes(), player, col, args.engine, args.depth, args.time)
+        except ValueError as error:
+            log_stderr(f"Skipping the rest of game {game_index}: {error}")
+
+
+def count_search_request(outcome: str) -> None:
+    """
+    Counts a search request made through a `CoalescingExecutor`.\n
+    :param outcome: 'hit', 'coalesced' or 'miss'
+    :return: None
+    """
+    METRICS.inc('c4_search_requests_total', outcome=outcome)
+
+
+def ordered_pool_map(func: Callable, tasks: Iterable[tuple[Any, Hashable]], workers: int, max_in_flight: int,
+                     initializer: Callable | None = None, initargs: tuple = (), cache_size: int = 0,
+                     on_result: Callable[[Any], None] | None = None) -> Iterator[tuple[Any, Any]]:
+    """
+    Maps a function over a stream of tagged tasks in a process pool,
+    yielding the results in input order while keeping at most `max_in_flight` tasks submitted.\n
+    Identical tasks share a single call while it runs, and the last `cache_size` results are reused.\n
+    :param func: picklable function applied to each task
+    :param tasks: stream of (tag, hashable task)
+    :param workers: number of worker processes
+    :param max_in_flight: maximum number of submitted, not yet consumed tasks
+    :param initializer: function called at the start of each worker process
+    :param initargs: arguments of `initializer`
+    :param cache_size: maximum number of results kept for reuse
+    :param on_result: function called with the result of every call actually made, in the main process
+    :return: a generator of (tag, result)
+    """
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                      initializer=initializer,
+                                                      initargs=initargs)
+    with CoalescingExecutor(executor, cache_size, on_request=count_search_request, on_result=on_result) as dispatcher:
+        in_flight = collections.deque()
+        for tag, task in tasks:
+            if len(in_flight) >= max_in_flight:
+                done_tag, future = in_flight.popleft()
+                yield done_tag, future.result()
+            in_flight.append((tag, dispatcher.submit(task, func, task)))
+
+        while in_flight:
+            done_tag, future = in_flight.popleft()
+            yield done_tag, future.result()
+
+
+def analyze_main(argv: list[str]) -> int:
+    """
+    Headless entry point for bulk position analysis.\n
+    Prints one tab-separated line per analyzed position:
+    game, ply, best column, score, depth, played column, score of the played move.\n
+    :param argv: command line arguments following `analyze`
+    :return: the exit code
+    """
+    parser = argparse.ArgumentParser(prog='4_in_a_row.py analyze',
+                                     description='Analyze positions from game records or move sequences.')
+    parser.add_argument('input', nargs='?', default='-', help="input file, '-' for stdin (default)")
+    parser.add_argument('--format', choices=('records', 'moves'), default='records',
+                        help="'records': binary game records, 'moves': one move sequence per line")
+    parser.add_argument('--engine', choices=ENGINES, default='negamax')
+    parser.add_argument('--depth', type=int, default=None,
+                        help='search depth (default: 5), maximum depth with --time (default: unlimited)')
+    parser.add_argument('--time', type=float, default=None, help='time budget per position, in seconds')
+    parser.add_argument('--rows', type=int, default=6, help="number of rows, for the 'moves' format")
+    parser.add_argument('--cols', type=int, default=7, help="initial number of columns, for the 'moves' format")
+    parser.add_argument('--first', choices=('player1', 'player2'), default='player1',
+                        help="first player, for the 'moves' format")
+    parser.add_argument('--final-only', action='store_true',
+                        help='only analyze the position reached at the end of each game')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='maximum number of queued positions (default: 4 per worker)')
+    parser.add_argument('--cache-size', type=int, default=4096,
+                        help='number of results kept to answer repeated positions (default: 4096)')
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                        help='profile the search of each position (default: from C4_PROFILE)')
+    parser.add_argument('--profile-dir', default='profiles', help='directory of the profiling reports')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='also report the top allocation sites of each position')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='serve metrics on http://127.0.0.1:PORT/metrics (default: from C4_METRICS_PORT)')
+    parser.add_argument('--metrics-file', default=METRICS_FILE,
+                        help='periodically write metrics to this file (default: from C4_METRICS_FILE)')
+    args = parser.parse_args(argv)
+
+    if not (4 <= args.rows <= MAX_ROW_COUNT and 4 <= args.cols <= MAX_COL_COUNT):
+        parser.error(f"rows must be between 4 and {MAX_ROW_COUNT} and columns between 4 and {MAX_COL_COUNT}")
+
+    start_metrics_exporters(args.metrics_port, args.metrics_file, METRICS_INTERVAL)
+
+    profiler = PROFILER
+    if args.profile is not None:
+        profiler = MoveProfiler(args.profile, args.profile_dir, args.profile_memory)
+
+    if args.depth is None:
+        args.depth = 5 if args.time is None else BIG_NUMBER
+    max_in_flight = args.max_in_flight or 4 * args.workers
+
+    tasks = iter_analysis_tasks(read_analysis_input(args), args)
+    try:
+        for tag, (analysis, _, _) in ordered_pool_map(analyze_position, tasks, args.workers, max_in_flight,
+                                                      init_worker, (WEIGHTS, profiler), args.cache_size,
+                                                      record_worker_search):
+            print('\t'.join('-' if value is None else str(value) for value in tag + analysis))
+            METRICS.inc('c4_positions_analyzed_total', engine=args.engine)
+    except BrokenPipeError:
+        # output piped into e.g. `head`
+        sys.stderr.close()
+        return 0
+
+    if args.metrics_file is not None:
+        METRICS.dump(args.metrics_file)
+
+    return 0
+
+
 if __name__ == '__main__':
+    load_weights(WEIGHTS_PATH)
+
+    try:
+        PROFILER = profiler_from_env()
+    except ValueError:
+        log('', error_msg=True)
+        exit(-1)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'analyze':
+        sys.exit(analyze_main(sys.argv[2:]))
+
+    start_metrics_exporters(METRICS_PORT, METRICS_FILE, METRICS_INTERVAL)
+
     init()
     pygame.init()
     game_board = init_board(ROW_COUNT, COL_COUNT)
 
-    game_loop(game_board)
+    with GameRecordWriter(RECORD_PATH) if RECORD_PATH else contextlib.nullcontext() as RECORDER:
+        game_loop(game_board)
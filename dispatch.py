@@ -0,0 +1,104 @@
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+# Request coalescing in front of an executor.
+#
+# Calls are identified by a key. While a call is running, later requests for the same key get the same future
+# instead of starting another one. Finished results are kept in a bounded cache (least recently used entries
+# are evicted first, and entries expire after `ttl` seconds), so a burst of identical requests costs one call.
+
+
+class CoalescingExecutor:
+    """
+    Deduplicates in-flight calls and caches their results in front of an executor. Thread-safe.\n
+    `on_request` is called with 'hit', 'coalesced' or 'miss' for every request, e.g. to count them,
+    and `on_result` with the result of every call actually made, e.g. to record what the calls did.
+    """
+
+    def __init__(self, executor: concurrent.futures.Executor, max_entries: int = 4096, ttl: float | None = None,
+                 on_request: Callable[[str], None] | None = None, on_result: Callable[[Any], None] | None = None):
+        self.executor = executor
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_request = on_request
+        self.on_result = on_result
+        self.hits = self.coalesced = self.misses = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._cache = collections.OrderedDict()
+
+    def submit(self, key: Hashable, func: Callable, *args) -> concurrent.futures.Future:
+        """
+        Runs `func(*args)` in the executor, unless the result of `key` is cached or already being computed.\n
+        :param key: identifies the result, equal keys must mean interchangeable results
+        :param func: function to call
+        :param args: arguments of the function
+        :return: a future of the result, shared by all the requests of the key made while it runs
+        """
+        with self._lock:
+            future, outcome = self._lookup(key)
+            if future is None:
+                self.misses += 1
+                future = self.executor.submit(func, *args)
+                self._in_flight[key] = future
+
+        if self.on_request is not None:
+            self.on_request(outcome)
+        if outcome == 'miss':
+            future.add_done_callback(lambda done: self._finish(key, done))
+        return future
+
+    def _lookup(self, key: Hashable) -> tuple[concurrent.futures.Future | None, str]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            result, expiry = cached
+            if expiry is None or expiry > time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                future = concurrent.futures.Future()
+                future.set_result(result)
+                return future, 'hit'
+            del self._cache[key]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future, 'coalesced'
+
+        return None, 'miss'
+
+    def _finish(self, key: Hashable, future: concurrent.futures.Future) -> None:
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+
+            if self.max_entries > 0:
+                expiry = None if self.ttl is None else time.monotonic() + self.ttl
+                self._cache[key] = (future.result(), expiry)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+        if self.on_result is not None:
+            self.on_result(future.result())
+
+    def clear(self) -> None:
+        """
+        Drops all the cached results.\n
+        :return: None
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self) -> 'CoalescingExecutor':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
@@ -0,0 +1,271 @@
+import os
+from typing import BinaryIO, Iterator, NamedTuple
+
+import numpy as np
+
+# Game record file layout:
+#   MAGIC + VERSION, written once when the file is created
+#   per game: rows, initial cols, first player, difficulty (1 byte each),
+#             one byte per move, END_OF_GAME, result
+# A move byte keeps the column in the low 6 bits and the growth direction
+# in the high 2 bits. Growth code 3 is never used by a move, so 0xFF is free
+# to mark the end of a game.
+
+MAGIC = b'C4GR'
+VERSION = 1
+FILE_HEADER = MAGIC + bytes([VERSION])
+GAME_HEADER_SIZE = 4
+
+END_OF_GAME = 0xFF
+NO_DIFFICULTY = 0xFF
+RESULT_DRAW = 0
+RESULT_UNFINISHED = 0xFF
+
+GROW_NONE = 0
+GROW_RIGHT = 1
+GROW_LEFT = 2
+
+COL_MASK = 0x3F
+GROWTH_SHIFT = 6
+
+__EMPTY__ = 0
+__PLAYER_ONE__ = 1
+__PLAYER_TWO__ = 2
+__COMPUTER__ = 3
+
+
+class GameRecord(NamedTuple):
+    rows: int
+    cols: int
+    first_player: int
+    difficulty: int | None
+    moves: bytes
+    result: int
+
+
+def encode_move(col: int, growth: int = GROW_NONE) -> int:
+    """
+    Packs a move into a single byte.\n
+    :param col: column in which the piece was dropped, before the board grew
+    :param growth: GROW_NONE, GROW_RIGHT or GROW_LEFT
+    :return: the encoded move byte
+    """
+    if not 0 <= col <= COL_MASK:
+        raise ValueError(f"Column out of encodable range: {col}")
+    if growth not in (GROW_NONE, GROW_RIGHT, GROW_LEFT):
+        raise ValueError(f"Unknown growth direction: {growth}")
+
+    return growth << GROWTH_SHIFT | col
+
+
+def decode_move(move: int) -> tuple[int, int]:
+    """
+    Unpacks a move byte.\n
+    :param move: the encoded move byte
+    :return: the column and the growth direction of the move
+    """
+    return move & COL_MASK, move >> GROWTH_SHIFT
+
+
+def second_player(first_player: int, difficulty: int | None) -> int:
+    """
+    Finds the player moving second, given who moved first and whether the computer played.\n
+    :param first_player: the player who made the first move
+    :param difficulty: the computer difficulty or None for a two player game
+    :return: the player making the second move
+    """
+    if first_player != __PLAYER_ONE__:
+        return __PLAYER_ONE__
+    return __PLAYER_TWO__ if difficulty is None else __COMPUTER__
+
+
+class GameRecordWriter:
+    """
+    Append-only, buffered writer for game records.\n
+    Moves of the current game are kept in memory and the whole game is written
+    in a single call when it ends, so records of different games never interleave.
+    """
+
+    def __init__(self, path: str | os.PathLike, buffer_size: int = 1 << 16):
+        self._file = open(path, 'ab', buffering=buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER)
+        self._game = None
+
+    def begin_game(self, rows: int, cols: int, first_player: int, difficulty: int | None = None) -> None:
+        """
+        Starts recording a new game, closing the previous one as unfinished if needed.\n
+        :param rows: number of rows of the board
+        :param cols: initial number of columns of the board
+        :param first_player: the player making the first move
+        :param difficulty: the computer difficulty or None for a two player game
+        :return: None
+        """
+        if self._game is not None:
+            self.end_game(RESULT_UNFINISHED)
+
+        self._game = bytearray((rows, cols, first_player,
+                                NO_DIFFICULTY if difficulty is None else difficulty))
+
+    def add_move(self, col: int, growth: int = GROW_NONE) -> None:
+        """
+        Records a move of the current game.\n
+        :param col: column in which the piece was dropped, before the board grew
+        :param growth: GROW_NONE, GROW_RIGHT or GROW_LEFT
+        :return: None
+        """
+        if self._game is None:
+            raise RuntimeError("No game in progress")
+
+        self._game.append(encode_move(col, growth))
+
+    def end_game(self, result: int) -> None:
+        """
+        Closes the current game and appends it to the file.\n
+        :param result: the winning player, RESULT_DRAW or RESULT_UNFINISHED
+        :return: None
+        """
+        if self._game is None:
+            return
+
+        self._game.append(END_OF_GAME)
+        self._game.append(result)
+        self._file.write(self._game)
+        self._game = None
+
+    def write_game(self, record: GameRecord) -> None:
+        """
+        Appends an already complete game.\n
+        :param record: the game to write
+        :return: None
+        """
+        self.begin_game(record.rows, record.cols, record.first_player, record.difficulty)
+        self._game += record.moves
+        self.end_game(record.result)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.end_game(RESULT_UNFINISHED)
+        self._file.close()
+
+    def __enter__(self) -> 'GameRecordWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_games(source: str | os.PathLike | BinaryIO, chunk_size: int = 1 << 16) -> Iterator[GameRecord]:
+    """
+    Lazily reads the games of a record file, one chunk at a time.\n
+    Concatenated record files (e.g. `cat a.c4r b.c4r`) are read as a single stream.\n
+    :param source: path of the record file or a binary stream
+    :param chunk_size: number of bytes read from the source at once
+    :return: a generator of the recorded games
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as stream:
+            yield from read_games(stream, chunk_size)
+        return
+
+    buf = source.read(len(FILE_HEADER))
+    if not buf:
+        return
+    if buf != FILE_HEADER:
+        raise ValueError("Not a game record file or unsupported version")
+
+    buf = b''
+    pos = 0
+    while True:
+        if buf.startswith(FILE_HEADER, pos):
+            pos += len(FILE_HEADER)
+            continue
+
+        end = buf.find(END_OF_GAME, pos + GAME_HEADER_SIZE)
+        if end == -1 or end + 1 >= len(buf):
+            chunk = source.read(chunk_size)
+            if not chunk:
+                if pos < len(buf):
+                    raise ValueError("Truncated game record")
+                return
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        rows, cols, first_player, difficulty = buf[pos: pos + GAME_HEADER_SIZE]
+        yield GameRecord(rows,
+                         cols,
+                         first_player,
+                         None if difficulty == NO_DIFFICULTY else difficulty,
+                         buf[pos + GAME_HEADER_SIZE: end],
+                         buf[end + 1])
+        pos = end + 2
+
+
+def apply_move(board: np.ndarray, heights: list[int], move: int, player: int) -> np.ndarray:
+    """
+    Plays a recorded move on a board being replayed.\n
+    :param board: game board
+    :param heights: number of pieces in each column, updated in place
+    :param move: the encoded move byte
+    :param player: the player making the move
+    :return: the board after the move, a new object if the board grew
+    """
+    col, growth = decode_move(move)
+    if col >= len(heights):
+        raise ValueError(f"Column out of range: {col}")
+    if heights[col] >= len(board):
+        raise ValueError(f"Column is already full: {col}")
+
+    board[len(board) - 1 - heights[col]][col] = player
+    heights[col] += 1
+
+    if growth == GROW_RIGHT:
+        board = np.insert(board, board.shape[1], __EMPTY__, axis=1)
+        heights.append(0)
+    elif growth == GROW_LEFT:
+        board = np.insert(board, 0, __EMPTY__, axis=1)
+        heights.insert(0, 0)
+
+    return board
+
+
+def iter_positions(record: GameRecord) -> Iterator[tuple[np.ndarray, int, int]]:
+    """
+    Replays a game, yielding each position before a move is made.\n
+    The same board object is reused between moves (until the board grows),
+    so copy it if it has to outlive the iteration step.\n
+    :param record: the game to replay
+    :return: a generator of (board, player to move, column played)
+    """
+    board = np.zeros((record.rows, record.cols))
+    heights = [0] * record.cols
+    player = record.first_player
+    other = second_player(record.first_player, record.difficulty)
+
+    for move in record.moves:
+        yield board, player, move & COL_MASK
+        board = apply_move(board, heights, move, player)
+        player, other = other, player
+
+
+def final_board(record: GameRecord) -> np.ndarray:
+    """
+    Replays a game up to its last move.\n
+    :param record: the game to replay
+    :return: the board after the last move
+    """
+    board = np.zeros((record.rows, record.cols))
+    heights = [0] * record.cols
+    player = record.first_player
+    other = second_player(record.first_player, record.difficulty)
+
+    for move in record.moves:
+        board = apply_move(board, heights, move, player)
+        player, other = other, player
+
+    return board
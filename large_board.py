@@ -0,0 +1,266 @@
+import math
+import time
+
+import numpy as np
+
+# AI for large boards (more than 9 rows or columns).
+#
+# The dense matrix search looks at every cell of the board at every node, so its cost grows with the board area.
+# Here the position only stores the occupied cells, the evaluation only looks at the intervals of four cells
+# containing at least one piece, wins are checked around the cell of the move being made, and the moves tried
+# are restricted to the columns close to existing pieces. The search deepens iteratively until a time budget runs
+# out, which bounds the latency of a move whatever the size of the board.
+#
+# Columns are indexed as on the game board; heights are counted from the bottom of the board.
+
+BIG_NUMBER = 999999
+ACTIVE_RADIUS = 3
+
+__EMPTY__ = 0
+
+DIRECTIONS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SparseBoard:
+    """
+    Game position storing only the occupied cells.
+    """
+
+    def __init__(self, rows: int, cols: int):
+        self.rows = rows
+        self.cols = cols
+        self.cells = {}
+        self.heights = {}
+
+    @classmethod
+    def from_array(cls, board: np.ndarray) -> 'SparseBoard':
+        """
+        Builds the sparse position of a game board.\n
+        :param board: game board
+        :return: the sparse position
+        """
+        rows, cols = board.shape
+        sparse = cls(rows, cols)
+        for row, col in zip(*np.nonzero(board)):
+            height = rows - 1 - int(row)
+            sparse.cells[(int(col), height)] = int(board[row][col])
+            sparse.heights[int(col)] = max(sparse.heights.get(int(col), 0), height + 1)
+
+        return sparse
+
+    def height(self, col: int) -> int:
+        return self.heights.get(col, 0)
+
+    def is_full(self) -> bool:
+        return len(self.cells) == self.rows * self.cols
+
+    def play(self, col: int, player: int) -> None:
+        """
+        Drops a piece in a column.\n
+        :param col: chosen column
+        :param player: current player
+        :return: None
+        """
+        height = self.heights.get(col, 0)
+        self.cells[(col, height)] = player
+        self.heights[col] = height + 1
+
+    def undo(self, col: int) -> None:
+        """
+        Removes the top piece of a column.\n
+        :param col: column of the move to revert
+        :return: None
+        """
+        height = self.heights[col] - 1
+        del self.cells[(col, height)]
+        if height:
+            self.heights[col] = height
+        else:
+            del self.heights[col]
+
+    def is_winning_move(self, col: int, player: int) -> bool:
+        """
+        Checks whether dropping a piece in a column aligns four pieces,
+        by only looking at the lines going through the new piece.\n
+        :param col: chosen column
+        :param player: current player
+        :return: True if the move wins the game
+        """
+        height = self.heights.get(col, 0)
+        cells = self.cells
+        for d_col, d_height in DIRECTIONS:
+            count = 1
+            for sign in (1, -1):
+                step = 1
+                while cells.get((col + sign * step * d_col, height + sign * step * d_height)) == player:
+                    count += 1
+                    step += 1
+            if count >= 4:
+                return True
+
+        return False
+
+    def candidate_moves(self, radius: int = ACTIVE_RADIUS) -> list[int]:
+        """
+        Lists the playable columns within `radius` columns of an occupied one, closest to the pieces' center first.
+        Falls back on every playable column when none of them is close to a piece.\n
+        :param radius: size of the active region around the occupied columns
+        :return: list of columns
+        """
+        if not self.heights:
+            return [self.cols // 2]
+
+        middle = (min(self.heights) + max(self.heights)) / 2
+        columns = {col + offset for col in self.heights for offset in range(-radius, radius + 1)}
+        moves = [col for col in columns if 0 <= col < self.cols and self.height(col) < self.rows]
+        if not moves:
+            moves = [col for col in range(self.cols) if self.height(col) < self.rows]
+
+        return sorted(moves, key=lambda col: abs(col - middle))
+
+    def score(self, player: int, weights: dict[str, float]) -> float:
+        """
+        Scores the position like `score_state`, visiting only the intervals which contain a piece
+        (the other ones are worth nothing).\n
+        :param player: current player
+        :param weights: evaluation weights
+        :return: score of the position for the player
+        """
+        cells = self.cells
+        windows = set()
+        for col, height in cells:
+            for d_col, d_height in DIRECTIONS:
+                for offset in range(4):
+                    start_col, start_height = col - offset * d_col, height - offset * d_height
+                    end_col, end_height = start_col + 3 * d_col, start_height + 3 * d_height
+                    if 0 <= start_col < self.cols and 0 <= end_col < self.cols \
+                            and 0 <= start_height < self.rows and 0 <= end_height < self.rows:
+                        windows.add((start_col, start_height, d_col, d_height))
+
+        score = 0
+        for start_col, start_height, d_col, d_height in windows:
+            own = empty = 0
+            for i in range(4):
+                piece = cells.get((start_col + i * d_col, start_height + i * d_height), __EMPTY__)
+                if piece == player:
+                    own += 1
+                elif piece == __EMPTY__:
+                    empty += 1
+            opponent = 4 - own - empty
+
+            if own == 4:
+                score += BIG_NUMBER
+            elif own == 3 and empty == 1:
+                score += weights['three']
+            elif own == 2 and empty == 2:
+                score += weights['two']
+
+            if opponent == 4:
+                score -= BIG_NUMBER
+            elif opponent == 3 and empty == 1:
+                score += weights['opponent_three']
+            elif opponent == 2 and empty == 2:
+                score += weights['opponent_two']
+
+        center_col = self.cols // 2
+        score += weights['center'] * sum(1 for height in range(self.height(center_col))
+                                         if cells[(center_col, height)] == player)
+
+        return score
+
+
+def negamax(board: SparseBoard, depth: int, player: int, opponent: int, alpha: float, beta: float,
+            deadline: float, weights: dict[str, float], stats: dict[str, int]) -> float:
+    """
+    Negamax search with alpha-beta pruning over the active region of a sparse position.\n
+    :param board: position, modified during the search and restored afterwards
+    :param depth: remaining search depth
+    :param player: player to move
+    :param opponent: the other player
+    :param alpha: minimum score to find
+    :param beta: maximum score to find
+    :param deadline: `time.monotonic()` value at which the search is abandoned with `SearchTimeout`
+    :param weights: evaluation weights
+    :param stats: counters updated by the search ('nodes')
+    :return: score of the position for the player to move
+    """
+    stats['nodes'] += 1
+    if time.monotonic() > deadline:
+        raise SearchTimeout()
+
+    if board.is_full():
+        return 0
+
+    moves = board.candidate_moves()
+
+    # check if there is any direct next move to win the game, sooner wins score higher
+    for col in moves:
+        if board.is_winning_move(col, player):
+            return BIG_NUMBER + depth
+
+    if depth == 0:
+        return board.score(player, weights)
+
+    best_score = -math.inf
+    for col in moves:
+        board.play(col, player)
+        score = -negamax(board, depth - 1, opponent, player, -beta, -alpha, deadline, weights, stats)
+        board.undo(col)
+
+        best_score = max(best_score, score)
+        alpha = max(alpha, best_score)
+        if alpha >= beta:
+            break
+
+    return best_score
+
+
+def choose_move(board: SparseBoard, player: int, opponent: int, max_depth: int, time_limit: float,
+                weights: dict[str, float]) -> tuple[int, float, int, int]:
+    """
+    Finds the best move with iterative deepening: deeper searches are started until `max_depth` or until the
+    time budget runs out, in which case the unfinished search is dropped and the last complete one is used.\n
+    :param board: position
+    :param player: player to move
+    :param opponent: the other player
+    :param max_depth: maximum search depth
+    :param time_limit: time budget in seconds
+    :param weights: evaluation weights
+    :return: the best column, its score, the depth of the last complete search and the number of nodes searched
+    """
+    deadline = time.monotonic() + time_limit
+    stats = {'nodes': 0}
+    moves = board.candidate_moves()
+
+    for col in moves:
+        if board.is_winning_move(col, player):
+            return col, BIG_NUMBER + max_depth, 0, 1
+
+    best_col, best_score, reached = moves[0], None, 0
+    for depth in range(1, max_depth + 1):
+        alpha, depth_best_col, depth_best_score = -math.inf, None, -math.inf
+        try:
+            for col in moves:
+                board.play(col, player)
+                try:
+                    score = -negamax(board, depth - 1, opponent, player, -math.inf, -alpha, deadline, weights, stats)
+                finally:
+                    board.undo(col)
+                if score > depth_best_score:
+                    depth_best_col, depth_best_score = col, score
+                    alpha = max(alpha, score)
+        except SearchTimeout:
+            break
+
+        best_col, best_score, reached = depth_best_col, depth_best_score, depth
+        # try the best move first at the next depth, it makes the pruning much more effective
+        moves.remove(best_col)
+        moves.insert(0, best_col)
+        if best_score >= BIG_NUMBER:
+            break
+
+    return best_col, best_score, reached, stats['nodes']
@@ -0,0 +1,210 @@
+import bisect
+import http.server
+import os
+import threading
+import time
+
+# In-process metrics with the Prometheus text exposition format.
+#
+# Every thread writes to its own shard, a plain dict only that thread ever modifies, so recording a value
+# takes no lock and never waits on other threads. Readers merge copies of all the shards; a lock is only
+# taken the first time a thread records something, to register its shard.
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metrics:
+    """
+    Registry of counters and histograms, identified by name and labels.
+    """
+
+    def __init__(self):
+        self._types = {}
+        self._help = {}
+        self._buckets = {}
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+
+    def counter(self, name: str, help_text: str) -> None:
+        """
+        Declares a counter.\n
+        :param name: metric name, ending in `_total`
+        :param help_text: description of the metric
+        :return: None
+        """
+        self._types[name] = 'counter'
+        self._help[name] = help_text
+
+    def histogram(self, name: str, help_text: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        """
+        Declares a histogram.\n
+        :param name: metric name
+        :param help_text: description of the metric
+        :param buckets: sorted upper bounds of the buckets
+        :return: None
+        """
+        self._types[name] = 'histogram'
+        self._help[name] = help_text
+        self._buckets[name] = tuple(buckets)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        """
+        Increments a counter.\n
+        :param name: counter name
+        :param amount: increment
+        :param labels: labels of the series
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        shard = self._shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """
+        Records a value in a histogram.\n
+        :param name: histogram name
+        :param value: the observed value
+        :param labels: labels of the series
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        shard = self._shard()
+        buckets = self._buckets[name]
+        series = shard.get(key)
+        if series is None:
+            # one count per bucket, the +Inf bucket, then the sum of the values
+            series = shard[key] = [0] * (len(buckets) + 1) + [0.0]
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self) -> dict:
+        """
+        Merges the values recorded by all threads.\n
+        :return: the value of each counter series and the bucket counts and sum of each histogram series
+        """
+        with self._shards_lock:
+            shards = list(self._shards)
+
+        merged = {}
+        for shard in shards:
+            for key, value in list(shard.items()):
+                if isinstance(value, list):
+                    value = list(value)
+                    total = merged.get(key)
+                    merged[key] = value if total is None else [a + b for a, b in zip(total, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+
+        return merged
+
+    def render(self) -> str:
+        """
+        Formats all the series in the Prometheus text exposition format.\n
+        :return: the metrics page
+        """
+        merged = self.collect()
+        lines = []
+        for name in sorted(self._types):
+            lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {self._types[name]}')
+            for (series_name, labels), value in sorted(merged.items()):
+                if series_name != name:
+                    continue
+                if self._types[name] == 'counter':
+                    lines.append(f'{name}{format_labels(labels)} {value:g}')
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(self._buckets[name] + (float('inf'),), value):
+                    cumulative += count
+                    bound = '+Inf' if bound == float('inf') else f'{bound:g}'
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {value[-1]:g}')
+                lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str) -> None:
+        """
+        Writes the metrics page to a file, replacing it atomically.\n
+        :param path: path of the file
+        :return: None
+        """
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+
+def format_labels(labels: tuple) -> str:
+    """
+    Formats the labels of a series.\n
+    :param labels: sorted (name, value) pairs
+    :return: the label set, e.g. `{difficulty="hard",board="6x7"}`
+    """
+    if not labels:
+        return ''
+
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def start_http_server(metrics: Metrics, port: int, host: str = '127.0.0.1') -> http.server.ThreadingHTTPServer:
+    """
+    Serves the metrics page on `http://host:port/metrics` from a background thread.\n
+    :param metrics: the metrics to serve
+    :param port: TCP port
+    :param host: address to listen on, local only by default
+    :return: the server, to be shut down with `shutdown()`
+    """
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def start_file_dump(metrics: Metrics, path: str, interval: float) -> threading.Thread:
+    """
+    Periodically writes the metrics page to a file from a background thread,
+    e.g. for the textfile collector of the Prometheus node exporter.\n
+    :param metrics: the metrics to write
+    :param path: path of the file
+    :param interval: seconds between two writes
+    :return: the background thread
+    """
+
+    def dump_forever() -> None:
+        while True:
+            time.sleep(interval)
+            metrics.dump(path)
+
+    thread = threading.Thread(target=dump_forever, daemon=True)
+    thread.start()
+
+    return thread
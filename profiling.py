@@ -0,0 +1,165 @@
+import collections
+import contextlib
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Iterator
+
+# Opt-in profiling of the AI moves.
+#
+# Every profiled move writes its files to the profile directory, named after the session, the process id,
+# the number of the move in that process, the board size, the search depth and the ply (number of pieces
+# on the board) of the move, so that concurrent games and repeated positions do not overwrite each other:
+#   <tag>.collapsed   collapsed stacks of the sampling profiler, one `frame;frame;frame count` line per stack,
+#                     to be rendered with flamegraph.pl, speedscope or inferno
+#   <tag>.prof        cProfile statistics, to be read with pstats or snakeviz
+#   <tag>.alloc.txt   peak memory traced while the move was computed, and the top sites by memory allocated
+#                     during the move and still held at its end (tracemalloc snapshots taken before and after)
+
+PROFILE_MODES = ('sample', 'cprofile')
+
+
+class StackSampler(threading.Thread):
+    """
+    Low-overhead sampling profiler: a background thread periodically records the stack of another thread.\n
+    The overhead does not depend on the number of calls made by the profiled code, unlike cProfile.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class MoveProfiler:
+    """
+    Profiles single AI moves and writes one set of report files per move.\n
+    Only holds its settings until a move is profiled, so it can be passed on to worker processes.
+    """
+
+    def __init__(self, mode: str, directory: str = 'profiles', memory: bool = False, top: int = 20,
+                 interval: float = 0.002):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}. Options: {' / '.join(PROFILE_MODES)}")
+
+        self.mode = mode
+        self.directory = directory
+        self.memory = memory
+        self.top = top
+        self.interval = interval
+        self.session = time.strftime('%Y%m%d-%H%M%S')
+        self.moves = 0
+
+    @contextlib.contextmanager
+    def profile_move(self, rows: int, cols: int, depth: int, ply: int, prefix: str = '') -> Iterator[None]:
+        """
+        Profiles the code run inside the `with` block.\n
+        :param rows: number of rows of the board
+        :param cols: number of columns of the board
+        :param depth: search depth of the move
+        :param ply: number of pieces on the board
+        :param prefix: prefix of the report file names, defaults to the start time of the session
+        :return: a context manager
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.moves += 1
+        tag = f'{prefix or self.session}-{os.getpid()}-{self.moves}-{rows}x{cols}-depth{depth}-ply{ply}'
+        path = os.path.join(self.directory, tag)
+
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        start_snapshot = start_memory = None
+        if self.memory:
+            start_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+
+        profiler = sampler = None
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(f'{path}.prof')
+            if sampler is not None:
+                sampler.stop()
+                with open(f'{path}.collapsed', 'w') as file:
+                    for stack, count in sampler.stacks.items():
+                        file.write(f'{stack} {count}\n')
+
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] - start_memory
+                snapshot = tracemalloc.take_snapshot()
+                if started_tracing:
+                    tracemalloc.stop()
+                self.write_allocations(f'{path}.alloc.txt', start_snapshot, snapshot, tag, elapsed, peak)
+
+    def write_allocations(self, path: str, start_snapshot: tracemalloc.Snapshot, snapshot: tracemalloc.Snapshot,
+                          tag: str, elapsed: float, peak: int) -> None:
+        """
+        Writes the peak memory of a move and the allocation sites which grew the most during it.\n
+        Memory allocated and freed again during the move only shows in the peak.\n
+        :param path: path of the report
+        :param start_snapshot: tracemalloc snapshot taken at the start of the move
+        :param snapshot: tracemalloc snapshot taken at the end of the move
+        :param tag: name of the profiled move
+        :param elapsed: duration of the move in seconds
+        :param peak: peak traced memory during the move, above the memory traced at its start, in bytes
+        :return: None
+        """
+        filters = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+        stats = snapshot.filter_traces(filters).compare_to(start_snapshot.filter_traces(filters), 'lineno')
+        with open(path, 'w') as file:
+            file.write(f'{tag}: {elapsed:.3f}s, peak {peak / 1024:.1f} KiB, '
+                       f'{sum(stat.size_diff for stat in stats) / 1024:+.1f} KiB held at the end\n')
+            for index, stat in enumerate(stats[:self.top], 1):
+                frame = stat.traceback[0]
+                file.write(f'#{index}: {frame.filename}:{frame.lineno}: '
+                           f'{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks\n')
+
+
+def profiler_from_env() -> MoveProfiler | None:
+    """
+    Creates the move profiler configured by the environment, if profiling is enabled:\n
+    `C4_PROFILE` (sample / cprofile), `C4_PROFILE_DIR`, `C4_PROFILE_MEMORY` (1 to enable tracemalloc)
+    and `C4_PROFILE_TOP` (number of allocation sites reported).\n
+    :return: the profiler or None
+    """
+    mode = os.environ.get('C4_PROFILE')
+    if not mode:
+        return None
+
+    return MoveProfiler(mode,
+                        os.environ.get('C4_PROFILE_DIR', 'profiles'),
+                        os.environ.get('C4_PROFILE_MEMORY', '0') not in ('', '0'),
+                        int(os.environ.get('C4_PROFILE_TOP', '20')))
@@ -0,0 +1,347 @@
+import argparse
+import functools
+import itertools
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+# Endgame tablebase file layout (little-endian):
+#   MAGIC, VERSION, rows, cols, max_empty (1 byte each), position count (uint64)
+#   sorted position keys (uint64), then one value per position (int8)
+#
+# A value is the exact score of the position for the player to move, with the same convention as the solver:
+# the number of empty cells left before the winning move for a win, its negation for a loss and 0 for a draw.
+#
+# Positions are stored as bitboards with `rows + 1` bits per column (the extra bit keeps
+# the columns apart), bit `col * (rows + 1) + height` standing for the cell `height` places above the bottom.
+# The key of a position is `pieces of the player to move + mask of occupied cells`, which is unique.
+# Keys are stored on 64 bits, so only board sizes with `cols * (rows + 1) <= 64` are supported.
+#
+# The tablebases do not model the growth of the board: the values assume that the board keeps its width,
+# so only the solver uses them: the game boards which can no longer grow are too large for a tablebase.
+#
+# Every coloring of every board of a layer is enumerated, from the full boards up, so the generation time
+# grows with the number of these candidates (see `count_candidates`) and not with `max_empty` alone:
+# boards of more than about 25 cells are out of reach.
+
+MAGIC = b'C4TB'
+VERSION = 1
+HEADER_SIZE = 16
+KEY_BITS = 64
+
+# number of candidate positions above which the generator refuses a board size, a few minutes of work
+MAX_CANDIDATES = 2 * 10 ** 8
+
+TABLEBASE_DIR = os.environ.get('C4_TABLEBASE_DIR', 'tablebases')
+
+__EMPTY__ = 0
+
+
+def tablebase_path(directory: str, rows: int, cols: int) -> str:
+    """
+    Builds the file name of the tablebase of a board size.\n
+    :param directory: tablebase directory
+    :param rows: number of rows
+    :param cols: number of columns
+    :return: path of the tablebase file
+    """
+    return os.path.join(directory, f'{rows}x{cols}.c4tb')
+
+
+def fits_key(rows: int, cols: int) -> bool:
+    """
+    Checks whether the positions of a board size fit in a tablebase key.\n
+    :param rows: number of rows
+    :param cols: number of columns
+    :return: True if the board size can have a tablebase
+    """
+    return cols * (rows + 1) <= KEY_BITS
+
+
+def count_candidates(rows: int, cols: int, max_empty: int) -> int:
+    """
+    Counts the positions enumerated by `generate`: every coloring of every board with at most `max_empty` empty cells,
+    before the ones where a player has four aligned pieces are dropped.\n
+    :param rows: number of rows
+    :param cols: number of columns
+    :param max_empty: maximum number of empty cells of the stored positions
+    :return: the number of candidate positions
+    """
+    # number of ways to fill the columns with each number of pieces
+    fillings = [1]
+    for _ in range(cols):
+        fillings = [sum(fillings[count - height] for height in range(rows + 1) if 0 <= count - height < len(fillings))
+                    for count in range(len(fillings) + rows)]
+
+    cell_count = rows * cols
+    return sum(fillings[cell_count - empty_count] * math.comb(cell_count - empty_count, (cell_count - empty_count) // 2)
+               for empty_count in range(min(max_empty, cell_count, 127) + 1))
+
+
+def has_four(bits: int, rows: int) -> bool:
+    """
+    Checks whether a bitboard contains four aligned pieces.\n
+    :param bits: bitboard of a player's pieces
+    :param rows: number of rows of the board
+    :return: True if there are four aligned pieces
+    """
+    for shift in (1, rows, rows + 1, rows + 2):  # vertical, diagonal, horizontal, other diagonal
+        pairs = bits & (bits >> shift)
+        if pairs & (pairs >> 2 * shift):
+            return True
+
+    return False
+
+
+def board_to_bits(board: np.ndarray, player: int) -> tuple[int, int]:
+    """
+    Converts a game board to bitboards.\n
+    :param board: game board
+    :param player: player to move
+    :return: the pieces of the player to move and the mask of occupied cells
+    """
+    rows, cols = board.shape
+    current = mask = 0
+    for col in range(cols):
+        for height in range(rows):
+            piece = board[rows - 1 - height][col]
+            if piece == __EMPTY__:
+                break
+            bit = 1 << (col * (rows + 1) + height)
+            mask |= bit
+            if piece == player:
+                current |= bit
+
+    return current, mask
+
+
+def generate(rows: int, cols: int, max_empty: int, verbose: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Builds the tablebase of a board size by retrograde analysis.\n
+    Positions are generated one layer at a time, from the full boards (0 empty cells) up to `max_empty` empty cells.
+    Every position of a layer is solved exactly from the values of the previous layer,
+    which are the positions reached after one more move.\n
+    Only positions where neither player already has four aligned pieces are stored.\n
+    :param rows: number of rows
+    :param cols: number of columns
+    :param max_empty: maximum number of empty cells of the stored positions
+    :param verbose: log the size of each layer
+    :return: the sorted keys and their values
+    """
+    cell_count = rows * cols
+    max_empty = min(max_empty, cell_count, 127)
+    column_bits = [[1 << (col * (rows + 1) + height) for height in range(rows + 1)] for col in range(cols)]
+
+    keys, values = [], []
+    previous_layer = {}
+    for empty_count in range(max_empty + 1):
+        start_time = time.time()
+        piece_count = cell_count - empty_count
+        layer = {}
+
+        for heights in itertools.product(range(rows + 1), repeat=cols):
+            if sum(heights) != piece_count:
+                continue
+
+            mask = 0
+            cells = []
+            for col, height in enumerate(heights):
+                cells += column_bits[col][:height]
+            for cell in cells:
+                mask |= cell
+            moves = [column_bits[col][height] for col, height in enumerate(heights) if height < rows]
+
+            # the player to move has made as many moves as the other one, or one fewer
+            for own_cells in itertools.combinations(cells, piece_count // 2):
+                current = sum(own_cells)
+                if has_four(current, rows) or has_four(mask ^ current, rows):
+                    continue
+
+                value = 0 if not moves else -128
+                for move in moves:
+                    if has_four(current | move, rows):
+                        value = empty_count
+                        break
+                    value = max(value, -previous_layer[(mask ^ current) + (mask | move)])
+
+                layer[current + mask] = value
+
+        keys += layer.keys()
+        values += layer.values()
+        previous_layer = layer
+        if verbose:
+            print(f'[4InaRow]: {rows}x{cols} tablebase, {empty_count} empty cells: '
+                  f'{len(layer)} positions ({time.time() - start_time:.1f}s)', flush=True)
+
+    keys = np.array(keys, dtype='<u8')
+    values = np.array(values, dtype=np.int8)
+    order = np.argsort(keys)
+
+    return keys[order], values[order]
+
+
+def write_tablebase(path: str, rows: int, cols: int, max_empty: int, keys: np.ndarray, values: np.ndarray) -> None:
+    """
+    Writes a tablebase file.\n
+    :param path: path of the file
+    :param rows: number of rows
+    :param cols: number of columns
+    :param max_empty: maximum number of empty cells of the stored positions
+    :param keys: sorted position keys
+    :param values: values of the positions
+    :return: None
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(MAGIC + bytes([VERSION, rows, cols, max_empty]))
+        file.write(len(keys).to_bytes(8, 'little'))
+        file.write(keys.astype('<u8').tobytes())
+        file.write(values.astype(np.int8).tobytes())
+
+
+class Tablebase:
+    """
+    Memory-mapped endgame tablebase of a single board size.\n
+    Lookups are binary searches over the sorted keys, so only the pages that are actually used get loaded.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            header = file.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or header[:4] != MAGIC or header[4] != VERSION:
+            raise ValueError(f"Not a tablebase file or unsupported version: {path}")
+
+        self.rows, self.cols, self.max_empty = header[5], header[6], header[7]
+        count = int.from_bytes(header[8:], 'little')
+        self._keys = np.memmap(path, dtype='<u8', mode='r', offset=HEADER_SIZE, shape=(count,))
+        self._values = np.memmap(path, dtype=np.int8, mode='r', offset=HEADER_SIZE + 8 * count, shape=(count,))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def covers(self, board: np.ndarray) -> bool:
+        """
+        Checks whether a board has the size of the tablebase and few enough empty cells.\n
+        The caller is responsible for only using the tablebase on boards which cannot grow any more.\n
+        :param board: game board
+        :return: True if the positions of the board can be looked up
+        """
+        return board.shape == (self.rows, self.cols) \
+            and fits_key(self.rows, self.cols) \
+            and np.count_nonzero(board == __EMPTY__) <= self.max_empty
+
+    def lookup_key(self, key: int) -> int | None:
+        """
+        Finds the value of a position key.\n
+        :param key: position key
+        :return: the value of the position or None if it is not in the tablebase
+        """
+        index = int(np.searchsorted(self._keys, key))
+        if index < len(self._keys) and int(self._keys[index]) == key:
+            return int(self._values[index])
+        return None
+
+    def lookup(self, board: np.ndarray, player: int) -> int | None:
+        """
+        Finds the exact score of a position.\n
+        :param board: game board
+        :param player: player to move
+        :return: the score for the player to move or None if the position is not covered
+        """
+        if not self.covers(board):
+            return None
+
+        current, mask = board_to_bits(board, player)
+        return self.lookup_key(current + mask)
+
+    def best_move(self, board: np.ndarray, player: int) -> tuple[int, int] | None:
+        """
+        Finds a perfect move of a position.\n
+        :param board: game board
+        :param player: player to move
+        :return: the best column and its exact score or None if the position is not covered
+        """
+        if not self.covers(board):
+            return None
+
+        rows = self.rows
+        current, mask = board_to_bits(board, player)
+        empty_count = int(np.count_nonzero(board == __EMPTY__))
+
+        best_col, best_score = None, None
+        for col in range(self.cols):
+            height = (mask >> (col * (rows + 1))) & ((1 << rows) - 1)
+            height = height.bit_length()
+            if height == rows:
+                continue
+
+            move = 1 << (col * (rows + 1) + height)
+            if has_four(current | move, rows):
+                return col, empty_count
+
+            child_score = self.lookup_key((mask ^ current) + (mask | move))
+            if child_score is None:
+                return None
+            if best_score is None or -child_score > best_score:
+                best_col, best_score = col, -child_score
+
+        return None if best_col is None else (best_col, best_score)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tablebase(rows: int, cols: int, directory: str = TABLEBASE_DIR) -> Tablebase | None:
+    """
+    Loads the tablebase of a board size, once.\n
+    :param rows: number of rows
+    :param cols: number of columns
+    :param directory: tablebase directory
+    :return: the tablebase or None if it has not been generated
+    """
+    path = tablebase_path(directory, rows, cols)
+    if not fits_key(rows, cols) or not os.path.exists(path):
+        return None
+
+    return Tablebase(path)
+
+
+def main(argv: list[str]) -> int:
+    """
+    Offline tablebase generator.\n
+    :param argv: command line arguments
+    :return: the exit code
+    """
+    parser = argparse.ArgumentParser(prog='tablebase.py',
+                                     description='Generate endgame tablebases by retrograde analysis.')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('cols', type=int)
+    parser.add_argument('max_empty', type=int, help='maximum number of empty cells of the stored positions')
+    parser.add_argument('--dir', default=TABLEBASE_DIR, help=f'output directory (default: {TABLEBASE_DIR})')
+    parser.add_argument('--force', action='store_true',
+                        help=f'generate even if there are more than {MAX_CANDIDATES:.0e} candidate positions')
+    args = parser.parse_args(argv)
+
+    if args.rows < 4 or args.cols < 4 or not fits_key(args.rows, args.cols):
+        print(f'[4InaRow]: Boards need at least 4 rows and 4 columns, '
+              f'and columns * (rows + 1) must not exceed {KEY_BITS}', flush=True)
+        return -1
+
+    candidates = count_candidates(args.rows, args.cols, args.max_empty)
+    if candidates > MAX_CANDIDATES and not args.force:
+        print(f'[4InaRow]: A {args.rows}x{args.cols} tablebase with {args.max_empty} empty cells enumerates '
+              f'{candidates:.1e} candidate positions, more than can be generated in reasonable time '
+              f'(limit {MAX_CANDIDATES:.0e}, override with --force)', flush=True)
+        return -1
+
+    keys, values = generate(args.rows, args.cols, args.max_empty, verbose=True)
+    path = tablebase_path(args.dir, args.rows, args.cols)
+    write_tablebase(path, args.rows, args.cols, min(args.max_empty, args.rows * args.cols, 127), keys, values)
+    print(f'[4InaRow]: Wrote {len(keys)} positions to {path}', flush=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,76 @@
+import io
+import os
+import tempfile
+import unittest
+
+from game_record import FILE_HEADER, GROW_LEFT, GROW_NONE, GROW_RIGHT, RESULT_DRAW, RESULT_UNFINISHED, GameRecord, \
+    GameRecordWriter, decode_move, encode_move, final_board, read_games
+
+GAMES = [
+    GameRecord(6, 7, 1, None, bytes([encode_move(3), encode_move(3), encode_move(6, GROW_RIGHT)]), 1),
+    GameRecord(4, 4, 3, 2, bytes([encode_move(0, GROW_LEFT), encode_move(1), encode_move(4, GROW_RIGHT)]), RESULT_DRAW),
+    GameRecord(16, 64, 1, 0, bytes([encode_move(63)] * 5), RESULT_UNFINISHED),
+    GameRecord(5, 5, 2, None, b'', 2),
+]
+
+
+class GameRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'games.c4r')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, path: str, games: list[GameRecord]) -> bytes:
+        with GameRecordWriter(path) as writer:
+            for game in games:
+                writer.write_game(game)
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def test_move_round_trip(self):
+        for col in range(64):
+            for growth in (GROW_NONE, GROW_RIGHT, GROW_LEFT):
+                self.assertEqual(decode_move(encode_move(col, growth)), (col, growth))
+
+        with self.assertRaises(ValueError):
+            encode_move(64)
+        with self.assertRaises(ValueError):
+            encode_move(0, 3)
+
+    def test_read_games_round_trip(self):
+        self.write(self.path, GAMES)
+        self.assertEqual(list(read_games(self.path)), GAMES)
+
+    def test_append_to_existing_file(self):
+        self.write(self.path, GAMES[:2])
+        data = self.write(self.path, GAMES[2:])
+        self.assertEqual(data.count(FILE_HEADER), 1)
+        self.assertEqual(list(read_games(self.path)), GAMES)
+
+    def test_concatenated_files(self):
+        first = self.write(self.path, GAMES[:2])
+        second = self.write(os.path.join(self.directory.name, 'other.c4r'), GAMES[2:])
+        self.assertEqual(list(read_games(io.BytesIO(first + second))), GAMES)
+
+    def test_chunk_boundaries(self):
+        data = self.write(self.path, GAMES) * 2
+        for chunk_size in range(1, len(data) + 2):
+            self.assertEqual(list(read_games(io.BytesIO(data), chunk_size)), GAMES * 2, chunk_size)
+
+    def test_truncated_file(self):
+        data = self.write(self.path, GAMES)
+        with self.assertRaises(ValueError):
+            list(read_games(io.BytesIO(data[:-1])))
+
+    def test_final_board(self):
+        board = final_board(GAMES[0])
+        self.assertEqual(board.shape, (6, 8))
+        self.assertEqual(list(board[:, 3]), [0, 0, 0, 0, 2, 1])
+        self.assertEqual(board[5][6], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,295 @@
+import argparse
+import concurrent.futures
+import functools
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from game_record import GameRecord, RESULT_DRAW, RESULT_UNFINISHED, iter_positions, read_games
+
+# Texel-style tuning of the evaluation weights used by `score_state`.
+#
+# `score_state` is linear in its weights: the score of a position is the number of intervals of each kind
+# (e.g. three own pieces and an empty slot) times the weight of that kind. Each position of the dataset is
+# therefore reduced once to its interval counts, and scoring a candidate weight vector over the whole dataset
+# is a single matrix product, which lets many candidates be evaluated together.
+#
+# Four aligned pieces are not tuned: they are a won game, scored with BIG_NUMBER by the AI algorithms,
+# and positions containing them are left out of the dataset.
+
+FEATURES = ('three', 'two', 'opponent_three', 'opponent_two', 'center')
+DEFAULT_WEIGHTS = {'three': 5, 'two': 2, 'opponent_three': -10, 'opponent_two': -2, 'center': 3}
+
+LABEL_LOSS = 0
+LABEL_DRAW = 1
+LABEL_WIN = 2
+
+__EMPTY__ = 0
+
+
+def read_weights(path: str) -> dict[str, float]:
+    """
+    Reads a weights file, falling back on the default weights for any missing entry.\n
+    Raises a ValueError if the file has unknown entries or values which are not finite numbers.\n
+    :param path: path of the JSON weights file
+    :return: the evaluation weights
+    """
+    with open(path) as file:
+        loaded = json.load(file)
+
+    if not isinstance(loaded, dict):
+        raise ValueError("The weights file must contain a JSON object")
+
+    unknown = set(loaded) - set(FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown evaluation weights: {', '.join(sorted(unknown))}")
+
+    weights = dict(DEFAULT_WEIGHTS)
+    for name, value in loaded.items():
+        try:
+            weights[name] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Evaluation weight {name} is not a number: {value!r}") from None
+        if not math.isfinite(weights[name]):
+            raise ValueError(f"Evaluation weight {name} is not finite: {value!r}")
+
+    return weights
+
+
+def write_weights(path: str, weights: dict[str, float]) -> None:
+    """
+    Writes a weights file.\n
+    :param path: path of the JSON weights file
+    :param weights: the evaluation weights
+    :return: None
+    """
+    with open(path, 'w') as file:
+        json.dump({name: round(float(weights[name]), 3) for name in FEATURES}, file, indent=4)
+        file.write('\n')
+
+
+@functools.lru_cache(maxsize=None)
+def window_indices(rows: int, cols: int) -> np.ndarray:
+    """
+    Lists the intervals of four cells scored by `score_state`, as indices into the flattened board.\n
+    Vertical intervals are scanned the way `score_horizontally` does on the transposed board,
+    i.e. only the first `cols - 3` of each column.\n
+    :param rows: number of rows
+    :param cols: number of columns
+    :return: a (number of intervals) x 4 array of indices
+    """
+    windows = []
+    for row, col in itertools.product(range(rows), range(cols - 3)):
+        windows.append([(row, col + i) for i in range(4)])
+    for col, row in itertools.product(range(cols), range(min(rows, cols) - 3)):
+        windows.append([(row + i, col) for i in range(4)])
+    for row, col in itertools.product(range(3, rows), range(cols - 3)):
+        windows.append([(row - i, col + i) for i in range(4)])
+        windows.append([(rows - 1 - row + i, col + i) for i in range(4)])
+
+    return np.array([[row * cols + col for row, col in window] for window in windows], dtype=np.intp)
+
+
+def position_features(board: np.ndarray, player: int) -> np.ndarray | None:
+    """
+    Counts the intervals of each kind scored by `score_state` for a player.\n
+    :param board: game board
+    :param player: the player the position is scored for
+    :return: the interval counts in the order of `FEATURES`, or None if the position contains four aligned pieces
+    """
+    rows, cols = board.shape
+    windows = board.ravel()[window_indices(rows, cols)]
+    own = np.count_nonzero(windows == player, axis=1)
+    empty = np.count_nonzero(windows == __EMPTY__, axis=1)
+    opponent = 4 - own - empty
+    if (own == 4).any() or (opponent == 4).any():
+        return None
+
+    return np.array([np.count_nonzero((own == 3) & (empty == 1)),
+                     np.count_nonzero((own == 2) & (empty == 2)),
+                     np.count_nonzero((opponent == 3) & (empty == 1)),
+                     np.count_nonzero((opponent == 2) & (empty == 2)),
+                     np.count_nonzero(board[:, cols // 2] == player)], dtype=np.int16)
+
+
+def game_features(record: GameRecord) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduces every position of a finished game to its interval counts,
+    labelled with the result of the game for the player to move.\n
+    :param record: the game
+    :return: the interval counts of the positions and their labels
+    """
+    features, labels = [], []
+    if record.result != RESULT_UNFINISHED:
+        for board, player, col in iter_positions(record):
+            position = position_features(board, player)
+            if position is None:
+                continue
+            features.append(position)
+            labels.append(LABEL_DRAW if record.result == RESULT_DRAW
+                          else LABEL_WIN if record.result == player
+                          else LABEL_LOSS)
+
+    return np.array(features, dtype=np.int16).reshape(-1, len(FEATURES)), np.array(labels, dtype=np.uint8)
+
+
+def load_dataset(sources: list[str], workers: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Streams the games of record files through a process pool and collects their labelled interval counts.\n
+    :param sources: paths of game record files
+    :param workers: number of worker processes
+    :return: the interval counts of all positions and their labels
+    """
+    games = itertools.chain.from_iterable(read_games(source) for source in sources)
+    features, labels = [], []
+    with multiprocessing.Pool(workers) as pool:
+        for game_positions, game_labels in pool.imap(game_features, games, chunksize=64):
+            features.append(game_positions)
+            labels.append(game_labels)
+
+    if not features:
+        return np.zeros((0, len(FEATURES)), dtype=np.int16), np.zeros(0, dtype=np.uint8)
+
+    return np.concatenate(features), np.concatenate(labels)
+
+
+def texel_loss(features: np.ndarray, targets: np.ndarray, weight_batch: np.ndarray,
+               executor: concurrent.futures.Executor, chunk_size: int = 1 << 18) -> np.ndarray:
+    """
+    Computes the mean squared error between the game results and the predicted winning probabilities
+    `sigmoid(score)` of a batch of (already scaled) weight vectors.\n
+    The dataset is split in chunks scored in parallel; numpy releases the GIL, so threads use all cores.\n
+    :param features: interval counts of the positions
+    :param targets: results of the positions (0 - loss, 0.5 - draw, 1 - win)
+    :param weight_batch: (batch size) x (number of features) array of weight vectors
+    :param executor: thread pool scoring the chunks
+    :param chunk_size: number of positions per chunk
+    :return: the loss of each weight vector
+    """
+    weight_batch = weight_batch.astype(np.float32)
+
+    def chunk_loss(start: int) -> np.ndarray:
+        scores = features[start: start + chunk_size].astype(np.float32) @ weight_batch.T
+        probabilities = 1 / (1 + np.exp(-np.clip(scores, -50, 50)))
+        return np.square(targets[start: start + chunk_size, None] - probabilities).sum(axis=0, dtype=np.float64)
+
+    total = sum(executor.map(chunk_loss, range(0, len(features), chunk_size)))
+    return total / max(len(features), 1)
+
+
+def fit_scale(features: np.ndarray, targets: np.ndarray, weights: np.ndarray,
+              executor: concurrent.futures.Executor) -> float:
+    """
+    Finds the factor mapping scores of the given weights to winning probabilities best.\n
+    :param features: interval counts of the positions
+    :param targets: results of the positions
+    :param weights: weight vector
+    :param executor: thread pool scoring the chunks
+    :return: the scale factor
+    """
+    scales = np.geomspace(1e-4, 10, 101)
+    for _ in range(3):
+        losses = texel_loss(features, targets, np.outer(scales, weights), executor)
+        best = int(np.argmin(losses))
+        scales = np.geomspace(scales[max(best - 1, 0)], scales[min(best + 1, len(scales) - 1)], 21)
+
+    return float(scales[len(scales) // 2])
+
+
+def tune(features: np.ndarray, targets: np.ndarray, weights: np.ndarray, scale: float,
+         executor: concurrent.futures.Executor, step: float = 1.0, min_step: float = 0.05,
+         max_iterations: int = 1000) -> np.ndarray:
+    """
+    Texel local search: every iteration evaluates, in a single batch, each weight moved up and down by `step`,
+    and keeps the best candidate. When no candidate improves the loss, the step is halved.\n
+    :param features: interval counts of the positions
+    :param targets: results of the positions
+    :param weights: initial weight vector
+    :param scale: factor mapping scores to winning probabilities
+    :param executor: thread pool scoring the chunks
+    :param step: initial step
+    :param min_step: the search stops when the step gets below this value
+    :param max_iterations: maximum number of batches evaluated
+    :return: the tuned weight vector
+    """
+    weights = weights.astype(np.float64)
+    best_loss = texel_loss(features, targets, scale * weights[None, :], executor)[0]
+    directions = np.concatenate([np.eye(len(weights)), -np.eye(len(weights))])
+
+    for iteration in range(max_iterations):
+        if step < min_step:
+            break
+
+        candidates = weights + step * directions
+        losses = texel_loss(features, targets, scale * candidates, executor)
+        best = int(np.argmin(losses))
+        if losses[best] < best_loss:
+            weights, best_loss = candidates[best], losses[best]
+        else:
+            step /= 2
+
+        print(f'[4InaRow]: iteration {iteration}: loss {best_loss:.6f}, step {step:g}, '
+              f'weights {np.round(weights, 3).tolist()}', flush=True)
+
+    return weights
+
+
+def main(argv: list[str]) -> int:
+    """
+    Tunes the evaluation weights on recorded games.\n
+    :param argv: command line arguments
+    :return: the exit code
+    """
+    parser = argparse.ArgumentParser(prog='tuning.py',
+                                     description='Tune the evaluation weights on recorded games (Texel method).')
+    parser.add_argument('records', nargs='*', help='game record files')
+    parser.add_argument('--output', default='weights.json', help='weights file to write (default: weights.json)')
+    parser.add_argument('--initial', default=None, help='weights file to start from (default: built-in weights)')
+    parser.add_argument('--cache', default=None,
+                        help='dataset cache: loaded if it exists, otherwise written after reading the records')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes / threads')
+    parser.add_argument('--step', type=float, default=1.0, help='initial step of the local search')
+    parser.add_argument('--min-step', type=float, default=0.05, help='final step of the local search')
+    parser.add_argument('--max-iterations', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    start_time = time.time()
+    if args.cache is not None and os.path.exists(args.cache):
+        with np.load(args.cache) as dataset:
+            features, labels = dataset['features'], dataset['labels']
+    elif args.records:
+        features, labels = load_dataset(args.records, args.workers)
+        if args.cache is not None:
+            np.savez(args.cache, features=features, labels=labels)
+    else:
+        parser.error('no game records and no dataset cache to tune on')
+    print(f'[4InaRow]: {len(labels)} positions loaded ({time.time() - start_time:.1f}s)', flush=True)
+
+    if not len(labels):
+        print('[4InaRow]: Nothing to tune on: no finished games', flush=True)
+        return -1
+
+    initial = read_weights(args.initial) if args.initial else DEFAULT_WEIGHTS
+    weights = np.array([initial[name] for name in FEATURES], dtype=np.float64)
+    targets = labels.astype(np.float32) / LABEL_WIN
+
+    with concurrent.futures.ThreadPoolExecutor(args.workers) as executor:
+        scale = fit_scale(features, targets, weights, executor)
+        print(f'[4InaRow]: scale {scale:g}', flush=True)
+        weights = tune(features, targets, weights, scale, executor,
+                       args.step, args.min_step, args.max_iterations)
+
+    write_weights(args.output, dict(zip(FEATURES, weights)))
+    print(f'[4InaRow]: Wrote {args.output}', flush=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))